@@ -1,6 +1,9 @@
-import pygame, sys, random, math, textwrap
-pygame.init()
-pygame.font.init()
+import pygame, sys, os, random, math, textwrap, bisect, time, argparse, struct, zlib, json, signal, tracemalloc, platform, functools, hashlib, subprocess, array
+from collections import OrderedDict, Counter, deque
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 WHITE = (255,255,255)
 BLACK = (0,0,0)
@@ -32,14 +35,43 @@ element_tints = {
     "shield": (200,200,200,80)
 }
 
-try:
-    FANTASY_FONT = pygame.font.SysFont("Castellar", 32)
-    FANTASY_FONT_SMALL = pygame.font.SysFont("Castellar", 22)
-    INFO_FONT = pygame.font.SysFont("Castellar", 24)
-except Exception as e:
-    FANTASY_FONT = pygame.font.SysFont("arial", 32)
-    FANTASY_FONT_SMALL = pygame.font.SysFont("arial", 22)
-    INFO_FONT = pygame.font.SysFont("arial", 24)
+FANTASY_FONTS = ("Castellar", "arial")
+MONO_FONTS = ("consolas", "menlo", "dejavusansmono", "monospace")
+
+class FontBook:
+    def __init__(self):
+        self.fonts = {}
+        self.paths = None
+    def cache_path(self):
+        return os.path.join(ASSET_CACHE_DIR, "fonts.json")
+    def resolve(self, families):
+        if self.paths is None:
+            try:
+                with open(self.cache_path()) as f:
+                    self.paths = json.load(f)
+            except (OSError, ValueError):
+                self.paths = {}
+        key = ",".join(families)
+        path = self.paths.get(key, False)
+        if path is False or (path is not None and not os.path.exists(path)):
+            path = next(filter(None, (pygame.font.match_font(name) for name in families)), None)
+            self.paths[key] = path
+            try:
+                os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+                with open(self.cache_path(), "w") as f:
+                    json.dump(self.paths, f)
+            except OSError:
+                pass
+        return path
+    def get(self, size, families=FANTASY_FONTS):
+        font = self.fonts.get((families, size))
+        if font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = self.fonts[(families, size)] = pygame.font.Font(self.resolve(families), size)
+        return font
+
+FONTS = FontBook()
 
 def draw_big_button(surface, rect, text, font, bg_color, border_color, text_color):
     shadow = rect.copy()
@@ -47,7 +79,7 @@ def draw_big_button(surface, rect, text, font, bg_color, border_color, text_colo
     pygame.draw.rect(surface, (0,0,0), shadow, border_radius=8)
     pygame.draw.rect(surface, bg_color, rect, border_radius=8)
     pygame.draw.rect(surface, border_color, rect, 4, border_radius=8)
-    txt = font.render(text, True, text_color)
+    txt = TEXT_CACHE.render(font, text, text_color)
     surface.blit(txt, txt.get_rect(center=rect.center))
 
 def wrap_text(text, font, max_width):
@@ -64,6 +96,153 @@ def wrap_text(text, font, max_width):
     if current_line: lines.append(current_line)
     return lines
 
+class GlyphAtlas:
+    def __init__(self, font, color, antialias=True):
+        self.font = font
+        self.color = color
+        self.antialias = antialias
+        self.glyphs = {}
+    def glyph(self, char):
+        entry = self.glyphs.get(char)
+        if entry is None:
+            metrics = self.font.metrics(char)
+            advance = metrics[0][4] if metrics and metrics[0] else self.font.size(char)[0]
+            entry = self.glyphs[char] = (self.font.render(char, self.antialias, self.color), advance)
+        return entry
+    def size(self, text):
+        return sum(self.glyph(char)[1] for char in text), self.font.get_height()
+    def blit(self, surface, text, pos):
+        x, y = pos
+        for char in text:
+            glyph, advance = self.glyph(char)
+            surface.blit(glyph, (x, y))
+            x += advance
+        return pygame.Rect(pos, (x-pos[0], self.font.get_height()))
+
+class TextCache:
+    def __init__(self, max_entries=256, max_layouts=64):
+        self.max_entries = max_entries
+        self.max_layouts = max_layouts
+        self.surfaces = OrderedDict()
+        self.layouts = OrderedDict()
+        self.atlases = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    def lookup(self, table, key, limit, build):
+        value = table.get(key)
+        if value is not None:
+            self.hits += 1
+            table.move_to_end(key)
+            return value
+        self.misses += 1
+        value = table[key] = build()
+        if len(table) > limit:
+            table.popitem(last=False)
+            self.evictions += 1
+        return value
+    def render(self, font, text, color, antialias=True):
+        return self.lookup(self.surfaces, (font, text, color, antialias), self.max_entries,
+                           lambda: font.render(text, antialias, color))
+    def wrap(self, text, font, max_width):
+        return self.lookup(self.layouts, (font, text, max_width), self.max_layouts,
+                           lambda: tuple(wrap_text(text, font, max_width)))
+    def atlas(self, font, color, antialias=True):
+        key = (font, color, antialias)
+        if key not in self.atlases:
+            self.atlases[key] = GlyphAtlas(font, color, antialias)
+        return self.atlases[key]
+    def clear(self):
+        self.surfaces.clear()
+        self.layouts.clear()
+        self.atlases.clear()
+    def stats(self):
+        total = self.hits + self.misses
+        return {"surfaces": len(self.surfaces), "layouts": len(self.layouts), "atlases": len(self.atlases),
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0}
+
+TEXT_CACHE = TextCache()
+
+class TraceWriter:
+    def __init__(self, path, buffer_size=20000):
+        self.file = open(path, "w")
+        self.file.write('[{"name":"thread_name","ph":"M","pid":1,"tid":1,"args":{"name":"main"}}')
+        self.origin = time.perf_counter()
+        self.buffer_size = buffer_size
+        self.events = []
+    def complete(self, name, start, end, cat="phase"):
+        self.events.append((name, cat, start, end))
+        if len(self.events) >= self.buffer_size:
+            self.flush()
+    def flush(self):
+        start = time.perf_counter()
+        origin = self.origin
+        self.file.write("".join(f',\n{{"name":{json.dumps(name)},"cat":"{cat}","ph":"X","ts":{(begin-origin)*1e6:.1f},"dur":{(end-begin)*1e6:.1f},"pid":1,"tid":1}}'
+                                for name, cat, begin, end in self.events))
+        self.events = [("trace_flush", "trace", start, time.perf_counter())]
+    def close(self):
+        self.flush()
+        self.flush()
+        self.file.write("]\n")
+        self.file.close()
+
+class FrameProfiler:
+    def __init__(self, history=180):
+        self.enabled = False
+        self.mark = 0.0
+        self.frame_start = 0.0
+        self.totals = {}
+        self.frame = {}
+        self.frame_times = deque(maxlen=history)
+        self.tracer = None
+    def enable(self, enabled):
+        if enabled != self.enabled:
+            self.frame_start = 0.0
+            self.totals = {}
+            self.frame = {}
+            self.frame_times.clear()
+        self.enabled = enabled
+        self.mark = time.perf_counter()
+    def start_trace(self, path):
+        self.tracer = TraceWriter(path)
+        self.enable(True)
+    def stop_trace(self):
+        if self.tracer is not None:
+            self.tracer.close()
+            self.tracer = None
+    def begin_frame(self):
+        now = time.perf_counter()
+        if self.frame_start:
+            self.frame_times.append((now - self.frame_start) * 1000.0)
+            if self.tracer is not None:
+                self.tracer.complete("frame", self.frame_start, now)
+        self.frame = self.totals
+        self.totals = {}
+        self.frame_start = self.mark = now
+    def lap(self, name):
+        now = time.perf_counter()
+        self.totals[name] = self.totals.get(name, 0.0) + (now - self.mark) * 1000.0
+        if self.tracer is not None:
+            self.tracer.complete(name, self.mark, now)
+        self.mark = now
+
+PROFILER = FrameProfiler()
+
+def traced(func):
+    name = func.__qualname__
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        tracer = PROFILER.tracer
+        if tracer is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            tracer.complete(name, start, time.perf_counter(), cat="call")
+    return wrapper
+
 PASSIVE_POOL = [
     {"id": "rapid_fire", "name": "Rapid Fire", "description": "Fires 10% faster.", "icon_color": (255,100,100), "effect": ("attack_speed", 1.10)},
     {"id": "mighty_strikes", "name": "Mighty Strikes", "description": "Deals 10% more damage.", "icon_color": (100,255,100), "effect": ("damage", 1.10)},
@@ -114,6 +293,19 @@ DEMON_INFO = [
     {"type": "Celestial Demon", "description": "Magical and exotic.", "icon_color": (255,200,50)}
 ]
 
+DEMON_SPAWN_TABLE = [
+    {"type": "Fast Demon", "roll": 0.10, "speed": 1.5, "health": 0.7, "color": (255,100,150), "element": "wind", "weakness": "frost"},
+    {"type": "Tank Demon", "roll": 0.20, "speed": 0.7, "health": 2, "color": (50,150,200), "element": "earth", "weakness": "shield"},
+    {"type": "Stealth Demon", "roll": 0.30, "speed": 1.0, "health": 0.8, "color": (150,150,50), "element": "shadow", "weakness": "swirl"},
+    {"type": "Special Demon", "roll": 0.40, "speed": 1.0, "speed_bonus": 5, "health": 1.2, "color": (200,100,255), "element": "fire", "weakness": "serpent"},
+    {"type": "Dark Demon", "roll": 0.50, "speed": 1.0, "health": 1.0, "color": (100,50,50), "element": "dark", "weakness": "swirl"},
+    {"type": "Frost Demon", "roll": 0.60, "speed": 0.9, "health": 1.1, "color": (150,220,255), "element": "frost", "weakness": "fire"},
+    {"type": "Storm Demon", "roll": 0.70, "speed": 1.2, "health": 0.9, "color": (255,255,100), "element": "lightning", "weakness": "arrow"},
+    {"type": "Venom Demon", "roll": 0.80, "speed": 1.0, "health": 1.0, "color": (100,0,200), "element": "toxin", "weakness": "holy"},
+    {"type": "Necro Demon", "roll": 0.90, "speed": 0.8, "health": 1.5, "color": (120,120,120), "element": "shadow", "weakness": "lightning"},
+    {"type": "Celestial Demon", "roll": 1.0, "speed": 1.1, "health": 1.0, "color": (255,200,50), "element": "holy", "weakness": "dark"}
+]
+
 ELEMENTS_INFO = [
     {"element": "Flame", "color": (255,69,0), "description": "Explosive, searing bursts."},
     {"element": "Frost", "color": (173,216,230), "description": "Icy blasts that slow enemies."},
@@ -159,23 +351,52 @@ def get_tower_description(tower_spec):
     rng = str(tower_spec["range"])
     return f"Name: {name}\nType: {typ}\nDamage: {damage}\nSpeed: {speed}\nRange: {rng}"
 
-def create_background_texture(width, height):
+def gradient_rows(height, top, bottom):
+    ratio = np.arange(height) / height
+    return np.stack([lo + (hi - lo) * ratio for lo, hi in zip(top, bottom)], axis=1).astype(np.uint8)
+
+@functools.lru_cache(maxsize=None)
+def circle_mask(radius, size=None):
+    size = size or radius * 2
+    surf = pygame.Surface((size, size), pygame.SRCALPHA)
+    pygame.draw.circle(surf, WHITE, (size // 2, size // 2), radius)
+    return pygame.surfarray.array_alpha(surf) > 0
+
+def blend_circles(pixels, circles, alpha):
+    width, height = pixels.shape[:2]
+    for x, y, rad, color in circles:
+        x0, y0 = x - rad, y - rad
+        mask = circle_mask(rad)[max(0, -x0):width - x0, max(0, -y0):height - y0]
+        region = pixels[max(0, x0):x0 + rad*2, max(0, y0):y0 + rad*2]
+        dst = region[mask].astype(np.int16)
+        src = np.array(color, np.int16)
+        region[mask] = ((((src - dst) * alpha + src) >> 8) + dst).astype(np.uint8)
+
+@traced
+def create_background_texture(width, height, rng=None):
+    rng = rng or random.Random()
     bg = pygame.Surface((width, height))
+    circles = [(rng.randint(0, width), rng.randint(0, height), rng.randint(5,15), (rng.randint(50,100), rng.randint(50,100), rng.randint(80,120))) for _ in range(100)]
+    if np is not None:
+        pixels = pygame.surfarray.pixels2d(bg)
+        pixels[:] = pygame.surfarray.map_array(bg, gradient_rows(height, (20,20,40), (80,80,120))[None])
+        del pixels
+        pixels = pygame.surfarray.pixels3d(bg)
+        blend_circles(pixels, circles, 80)
+        del pixels
+        return bg
     for y in range(height):
         r = int(20 + (80-20)*(y/height))
         g = int(20 + (80-20)*(y/height))
         b = int(40 + (120-40)*(y/height))
         pygame.draw.line(bg, (r,g,b), (0,y), (width,y))
-    for _ in range(100):
-        x = random.randint(0, width)
-        y = random.randint(0, height)
-        rad = random.randint(5,15)
-        col = (random.randint(50,100), random.randint(50,100), random.randint(80,120))
+    for x, y, rad, col in circles:
         s = pygame.Surface((rad*2, rad*2), pygame.SRCALPHA)
         pygame.draw.circle(s, col+(80,), (rad,rad), rad)
         bg.blit(s, (x-rad, y-rad))
     return bg
 
+@traced
 def create_castle_sprite():
     castle = pygame.Surface((40,40), pygame.SRCALPHA)
     pygame.draw.rect(castle, (150,150,150), (5,20,30,15))
@@ -184,6 +405,7 @@ def create_castle_sprite():
     pygame.draw.polygon(castle, BLACK, [(5,20),(20,5),(35,20)], 2)
     return castle
 
+@traced
 def create_spelltower_sprite(tower_spec):
     base_color = tower_spec.get("color", (180,180,180))
     design = tower_spec.get("design", "default")
@@ -224,6 +446,7 @@ def create_spelltower_sprite(tower_spec):
         pygame.draw.circle(surf, (max(base_color[0]-30,0), max(base_color[1]-30,0), max(base_color[2]-30,0)), (32,32), 28, 3)
     return surf
 
+@traced
 def create_tower_attack_sprites(tower_spec):
     idle = create_spelltower_sprite(tower_spec)
     attack = []
@@ -238,6 +461,7 @@ def create_tower_attack_sprites(tower_spec):
         attack.append(frame)
     return {"idle": idle, "attack": attack}
 
+@traced
 def create_demon_sprites(demon_type, base_color):
     sprites = []
     for frame in range(6):
@@ -274,6 +498,7 @@ def create_demon_sprites(demon_type, base_color):
         sprites.append(surf)
     return sprites
 
+@traced
 def create_projectile_sprites(element):
     sprites = []
     for frame in range(3):
@@ -316,6 +541,160 @@ def create_projectile_sprites(element):
         sprites.append(surf)
     return sprites
 
+class SpriteCache:
+    def __init__(self, factory):
+        self.factory = factory
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+    def get(self, *key):
+        sprites = self.entries.get(key)
+        if sprites is None:
+            self.misses += 1
+            sprites = self.entries[key] = self.factory(*key)
+        else:
+            self.hits += 1
+        return sprites
+    def invalidate(self):
+        self.entries.clear()
+    def stats(self):
+        total = self.hits + self.misses
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
+
+ASSET_VERSION = 1
+ASSET_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "spelltower-clash")
+ATLAS_MAGIC = b"STAT"
+ATLAS_WIDTH = 1024
+
+def tower_visual_key(tower_spec):
+    return (tower_spec.get("design", "default"), tuple(tower_spec.get("color", (180,180,180))), tuple(tower_spec.get("hybrid", ())))
+
+def projectile_elements():
+    elements = {"upgrade"}
+    for spec in TOWER_POOL:
+        elements.update(spec.get("hybrid") or [spec["design"]])
+    return sorted(elements)
+
+class SpriteAtlas:
+    def __init__(self):
+        self.frames = {}
+        self.surface = None
+        self.source = None
+    @staticmethod
+    def key(kind, key):
+        return json.dumps([kind, key])
+    def get(self, kind, key):
+        return self.frames.get(self.key(kind, key))
+    def inputs_hash(self):
+        inputs = [ASSET_VERSION, TOWER_POOL, DEMON_INFO, [(s["type"], s["color"]) for s in DEMON_SPAWN_TABLE],
+                  projectile_elements(), [(p["id"], p["icon_color"]) for p in PASSIVE_POOL]]
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
+    def generate(self):
+        frames = {}
+        for spec in TOWER_POOL:
+            sprites = create_tower_attack_sprites(spec)
+            frames[self.key("tower", tower_visual_key(spec))] = [sprites["idle"]] + sprites["attack"]
+        for spec in DEMON_SPAWN_TABLE:
+            frames[self.key("demon", (spec["type"], tuple(spec["color"])))] = create_demon_sprites(spec["type"], spec["color"])
+        for element in projectile_elements():
+            frames[self.key("projectile", element)] = create_projectile_sprites(element)
+        frames[self.key("castle", None)] = [create_castle_sprite()]
+        return frames
+    @traced
+    def pack(self, frames):
+        index, x, y, shelf = {}, 0, 0, 0
+        for name, sprites in frames.items():
+            rects = index[name] = []
+            for sprite in sprites:
+                w, h = sprite.get_size()
+                if x + w > ATLAS_WIDTH:
+                    x, y, shelf = 0, y + shelf, 0
+                rects.append((x, y, w, h))
+                x += w
+                shelf = max(shelf, h)
+        atlas = pygame.Surface((ATLAS_WIDTH, y + shelf), pygame.SRCALPHA)
+        for name, sprites in frames.items():
+            for sprite, rect in zip(sprites, index[name]):
+                atlas.blit(sprite, rect[:2])
+        return atlas, index
+    def adopt(self, atlas, index):
+        if pygame.display.get_init() and pygame.display.get_surface() is not None:
+            atlas = atlas.convert_alpha()
+        else:
+            atlas = atlas.copy()
+        self.surface = atlas
+        self.frames = {name: [atlas.subsurface(rect) for rect in rects] for name, rects in index.items()}
+    @traced
+    def load(self, path, digest):
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:len(ATLAS_MAGIC)] != ATLAS_MAGIC:
+            raise ValueError("not a sprite atlas")
+        header_size, = struct.unpack_from("<I", data, len(ATLAS_MAGIC))
+        start = len(ATLAS_MAGIC) + 4
+        header = json.loads(data[start:start + header_size])
+        if header["hash"] != digest:
+            raise ValueError("sprite atlas is stale")
+        atlas = pygame.image.frombuffer(memoryview(data)[start + header_size:], tuple(header["size"]), "BGRA")
+        return atlas, {name: [tuple(rect) for rect in rects] for name, rects in header["index"].items()}
+    @traced
+    def save(self, path, digest, atlas, index):
+        header = json.dumps({"hash": digest, "size": atlas.get_size(), "index": index}).encode()
+        pixels = pygame.image.tostring(atlas, "BGRA")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(ATLAS_MAGIC + struct.pack("<I", len(header)) + header + pixels)
+        os.replace(path + ".tmp", path)
+        for name in os.listdir(os.path.dirname(path)):
+            if name.startswith("atlas-") and name != os.path.basename(path):
+                os.remove(os.path.join(os.path.dirname(path), name))
+    def ensure(self, cache_dir=ASSET_CACHE_DIR):
+        if self.source is not None:
+            return self
+        digest = self.inputs_hash()
+        path = os.path.join(cache_dir, f"atlas-{digest}.bin") if cache_dir else None
+        try:
+            atlas, index = self.load(path, digest)
+            self.source = path
+        except (OSError, ValueError, TypeError, KeyError, struct.error):
+            atlas, index = self.pack(self.generate())
+            self.source = "generated"
+            if path:
+                try:
+                    self.save(path, digest, atlas, index)
+                except OSError:
+                    pass
+        self.adopt(atlas, index)
+        return self
+
+ASSETS = SpriteAtlas()
+
+def cached_frames(kind, key, factory):
+    frames = ASSETS.get(kind, key)
+    return frames if frames is not None else factory()
+
+PROJECTILE_SPRITE_CACHE = SpriteCache(lambda element: cached_frames("projectile", element, lambda: create_projectile_sprites(element)))
+PROJECTILE_POOL_CAP = 512
+DEMON_SPRITE_CACHE = SpriteCache(lambda demon_type, color, cell_size: cached_frames("demon", (demon_type, color), lambda: create_demon_sprites(demon_type, color)))
+
+def load_tower_sprites(design, color, hybrid):
+    frames = ASSETS.get("tower", (design, color, hybrid))
+    if frames is None:
+        return create_tower_attack_sprites({"design": design, "color": color, "hybrid": list(hybrid)})
+    return {"idle": frames[0], "attack": frames[1:]}
+
+TOWER_SPRITE_CACHE = SpriteCache(load_tower_sprites)
+
+def get_demon_sprites(demon_type, color):
+    return DEMON_SPRITE_CACHE.get(demon_type, tuple(color), CELL_SIZE)
+
+def get_tower_sprites(tower_spec):
+    return TOWER_SPRITE_CACHE.get(*tower_visual_key(tower_spec))
+
+def get_castle_sprite():
+    return cached_frames("castle", None, lambda: [create_castle_sprite()])[0]
+
 VIRTUAL_WIDTH = 1280
 VIRTUAL_HEIGHT = 720
 FPS = 60
@@ -325,6 +704,17 @@ RIGHT_PANEL_WIDTH = 200
 INFO_PANEL_HEIGHT = 100
 GRID_WIDTH = 10
 GRID_HEIGHT = 10
+ROUTE_COUNT = 1
+ROUTE_MIN_LENGTH = None
+ROUTE_MAX_LENGTH = None
+DIRTY_RECTS = False
+DIRTY_RECT_THRESHOLD = 0.5
+SIM_HZ = 120
+SIM_DT = 1.0 / SIM_HZ
+MAX_STEPS_PER_FRAME = 8
+PRESENT_MODE = "native"
+RESIZE_DEBOUNCE = 0.15
+PRESENT_MODES = ("native", "scale", "integer")
 
 def recalc_layout():
     global central_width, GAME_BOARD_HEIGHT, CELL_SIZE, GRID_OFFSET_X, GRID_OFFSET_Y
@@ -337,103 +727,174 @@ def recalc_layout():
 recalc_layout()
 
 class PathGenerator:
-    def __init__(self, grid_width, grid_height):
+    def __init__(self, grid_width, grid_height, rng=None):
         self.grid_width = grid_width
         self.grid_height = grid_height
+        self.rng = rng or random.Random()
         self.path_points = []
-    def generate_path(self):
-        self.path_points = []
-        start = (0, self.grid_height//2)
-        end = (self.grid_width-1, random.randint(0, self.grid_height-1))
-        current = start
-        self.path_points.append(current)
-        while current != end:
-            possible = []
-            x, y = current
-            if x+1 < self.grid_width:
-                possible.append((x+1, y))
-            if y-1 >= 0:
-                possible.append((x, y-1))
-            if y+1 < self.grid_height:
-                possible.append((x, y+1))
-            possible.sort(key=lambda pos: math.hypot(end[0]-pos[0], end[1]-pos[1]))
-            if len(possible) > 1 and random.random() < 0.3:
-                chosen = random.choice(possible[:2])
-            else:
-                chosen = possible[0]
-            current = chosen
-            if current not in self.path_points:
-                self.path_points.append(current)
-            if len(self.path_points) > self.grid_width * self.grid_height:
-                break
-        return self.path_points
+    def bands(self, count):
+        if not 1 <= count <= self.grid_height:
+            raise ValueError(f"cannot fit {count} routes on a grid {self.grid_height} rows high")
+        edges = [self.grid_height * i // count for i in range(count + 1)]
+        return list(zip(edges, edges[1:]))
+    @staticmethod
+    def capacity(y, band, columns):
+        lo, hi = band
+        return max(y - lo, hi - 1 - y) + (columns - 1) * (hi - lo - 1) if columns else 0
+    def generate_path(self, min_length=None, max_length=None):
+        return self.generate_routes(1, min_length, max_length)[0]
+    def generate_routes(self, count=1, min_length=None, max_length=None):
+        routes = []
+        for lo, hi in self.bands(count):
+            start = (lo + hi) // 2
+            shortest = self.grid_width
+            longest = shortest + self.capacity(start, (lo, hi), self.grid_width)
+            low, high = shortest + (hi - lo) // 5, shortest + (hi - lo) // 2
+            if min_length is not None and max_length is not None:
+                low, high = min_length, max_length
+            elif min_length is not None:
+                low, high = min_length, max(high, min_length)
+            elif max_length is not None:
+                low, high = min(low, max_length), max_length
+            if low > high or low > longest or high < shortest:
+                wanted = f"{low}-{high}" if min_length is not None and max_length is not None else f"at least {low}" if min_length is not None else f"at most {high}"
+                raise ValueError(f"no route of length {wanted} fits rows {lo}-{hi - 1} (possible: {shortest}-{longest})")
+            routes.append(self.walk(start, (lo, hi), self.rng.randint(max(low, shortest), min(high, longest)) - shortest))
+        self.path_points = routes[-1]
+        return routes
+    def walk(self, y, band, climb):
+        lo, hi = band
+        path = [(0, y)]
+        for x in range(self.grid_width):
+            after = self.grid_width - 1 - x
+            rows = [r for r in range(lo, hi) if abs(r - y) <= climb and climb - abs(r - y) <= self.capacity(r, band, after)]
+            limit = max(min(abs(r - y) for r in rows), 2 * climb // (after + 1) + 1)
+            target = self.rng.choice([r for r in rows if abs(r - y) <= limit])
+            step = 1 if target > y else -1
+            path.extend((x, r) for r in range(y + step, target + step, step))
+            climb -= abs(target - y)
+            y = target
+            if after:
+                path.append((x + 1, y))
+        return path
+
+class Board:
+    EMPTY = -1
+    PATH = -2
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.cells = array.array("i", [self.EMPTY]) * (width * height)
+    def at(self, cell):
+        x, y = cell
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.cells[x * self.height + y]
+        return None
+    def set(self, cell, value):
+        self.cells[cell[0] * self.height + cell[1]] = value
+    def mark_path(self, route):
+        for cell in route:
+            self.set(cell, self.PATH)
+    def is_free(self, cell):
+        return self.at(cell) == self.EMPTY
+    def is_path(self, cell):
+        return self.at(cell) == self.PATH
+    def free_cells(self):
+        return [divmod(i, self.height) for i, value in enumerate(self.cells) if value == self.EMPTY]
+    def grid(self):
+        return np.frombuffer(self.cells, np.intc).reshape(self.width, self.height)
 
 class TowerDeck:
-    def __init__(self, deck_size=3):
+    def __init__(self, deck_size=3, render=True, rng=None, pool=None):
         self.deck_size = deck_size
-        self.font = FANTASY_FONT_SMALL
-        self.tooltip_font = FANTASY_FONT_SMALL
+        self.render = render
+        self.rng = rng or random.Random()
+        self.pool = pool or TOWER_POOL
+        self.font = self.tooltip_font = FONTS.get(22) if render else None
         self.buttons = []
         self.create_buttons()
     def create_buttons(self):
-        self.buttons = []
-        self.options = random.sample(TOWER_POOL, self.deck_size)
+        self.options = self.rng.sample(self.pool, self.deck_size)
+        self.buttons = [{"rect": pygame.Rect(0, 0, 0, 0), "tower_spec": tower_spec, "purchased": False} for tower_spec in self.options]
+        self.layout()
+    def layout(self):
         margin = 20
         panel_height = VIRTUAL_HEIGHT - TOP_PANEL_HEIGHT
         gap = 10
         button_height = (panel_height - 2*margin - gap*(self.deck_size-1)) // self.deck_size
         button_width = LEFT_PANEL_WIDTH - 2*margin
-        for i, tower_spec in enumerate(self.options):
+        resized = False
+        for i, btn in enumerate(self.buttons):
             rect = pygame.Rect(margin, margin + i*(button_height+gap), button_width, button_height)
-            self.buttons.append({"rect": rect, "tower_spec": tower_spec, "purchased": False})
-    def draw(self, surface, offset=(0, TOP_PANEL_HEIGHT)):
+            resized |= rect.size != btn["rect"].size
+            btn["rect"] = rect
+        if self.render and resized:
+            self.render_cards()
+    @traced
+    def render_cards(self):
+        for btn in self.buttons:
+            btn["card"] = self.render_card(btn["rect"].size, btn["tower_spec"])
+    def render_card(self, size, tower_spec):
+        card = pygame.Surface((size[0]+4, size[1]+4), pygame.SRCALPHA)
+        rect = pygame.Rect((0, 0), size)
+        draw_big_button(card, rect, "", self.font, SHOP_BUTTON_COLOR, BLACK, WHITE)
+        preview_sprite = get_tower_sprites(tower_spec)["idle"]
+        preview_sprite = pygame.transform.scale(preview_sprite, (50,50))
+        preview_rect = pygame.Rect(rect.centerx-25, rect.y+5, 50, 50)
+        card.blit(preview_sprite, preview_rect.topleft)
+        text_lines = []
+        text_lines.append(tower_spec["name"])
+        if "hybrid" in tower_spec:
+            types = ", ".join(tower_spec["hybrid"])
+        else:
+            types = tower_spec.get("design", "Unknown")
+        text_lines.append("Type: " + types.capitalize())
+        text_lines.append("Damage: " + str(tower_spec["damage"]))
+        text_lines.append("Speed: " + str(tower_spec["attack_rate"]))
+        text_lines.append("Range: " + str(tower_spec["range"]))
+        y_text = preview_rect.bottom + 2
+        for line in text_lines:
+            t = self.tooltip_font.render(line, True, WHITE)
+            card.blit(t, (rect.x+5, y_text))
+            y_text += self.tooltip_font.get_linesize()
+        return card
+    def draw_cards(self, surface, offset=(0, TOP_PANEL_HEIGHT)):
         ox, oy = offset
         for btn in self.buttons:
             if not btn["purchased"]:
-                adj_rect = btn["rect"].move(ox, oy)
-                draw_big_button(surface, adj_rect, "", self.font, SHOP_BUTTON_COLOR, BLACK, WHITE)
-                preview_sprite = create_spelltower_sprite(btn["tower_spec"])
-                preview_sprite = pygame.transform.scale(preview_sprite, (50,50))
-                preview_rect = pygame.Rect(adj_rect.centerx-25, adj_rect.y+5, 50, 50)
-                surface.blit(preview_sprite, preview_rect.topleft)
-                text_lines = []
-                text_lines.append(btn["tower_spec"]["name"])
-                if "hybrid" in btn["tower_spec"]:
-                    types = ", ".join(btn["tower_spec"]["hybrid"])
-                else:
-                    types = btn["tower_spec"].get("design", "Unknown")
-                text_lines.append("Type: " + types.capitalize())
-                text_lines.append("Damage: " + str(btn["tower_spec"]["damage"]))
-                text_lines.append("Speed: " + str(btn["tower_spec"]["attack_rate"]))
-                text_lines.append("Range: " + str(btn["tower_spec"]["range"]))
-                y_text = preview_rect.bottom + 2
-                for line in text_lines:
-                    t = self.tooltip_font.render(line, True, WHITE)
-                    surface.blit(t, (adj_rect.x+5, y_text))
-                    y_text += self.tooltip_font.get_linesize()
+                surface.blit(btn["card"], btn["rect"].move(ox, oy).topleft)
+    def draw_sparkles(self, surface):
         current_time = pygame.time.get_ticks()/1000.0
-        random.seed(int(current_time*0.3))
+        sparkle_rng = random.Random(int(current_time*0.3))
+        rects = []
         for _ in range(2):
-            sx = random.randint(0, LEFT_PANEL_WIDTH)
-            sy = random.randint(TOP_PANEL_HEIGHT, TOP_PANEL_HEIGHT+(VIRTUAL_HEIGHT-TOP_PANEL_HEIGHT))
-            radius = random.randint(2,3)
-            pygame.draw.circle(surface, YELLOW, (sx, sy), radius)
+            sx = sparkle_rng.randint(0, LEFT_PANEL_WIDTH)
+            sy = sparkle_rng.randint(TOP_PANEL_HEIGHT, TOP_PANEL_HEIGHT+(VIRTUAL_HEIGHT-TOP_PANEL_HEIGHT))
+            radius = sparkle_rng.randint(2,3)
+            rects.append(pygame.draw.circle(surface, YELLOW, (sx, sy), radius))
+        return rects
     def handle_event(self, event, game_manager):
         if event.type == pygame.MOUSEBUTTONDOWN:
             pos = event.pos
             local_pos = (pos[0], pos[1]-TOP_PANEL_HEIGHT)
             for i, btn in enumerate(self.buttons):
                 if btn["rect"].collidepoint(local_pos) and not btn["purchased"]:
-                    if game_manager.gold >= 25:
-                        game_manager.gold -= 25
-                        btn["purchased"] = True
-                        game_manager.current_tower_selection = btn["tower_spec"].copy()
-                        self.buttons.pop(i)
+                    game_manager.buy_tower(i)
                     break
+    def purchase(self, index, game_manager):
+        btn = self.buttons[index]
+        if game_manager.gold >= 25:
+            game_manager.gold -= 25
+            btn["purchased"] = True
+            game_manager.current_tower_selection = btn["tower_spec"].copy()
+            self.buttons.pop(index)
+            game_manager.notify("purchase")
+            return True
+        return False
 
 class PassiveTracker:
     def __init__(self, font):
-        self.font = FANTASY_FONT_SMALL
+        self.font = FONTS.get(22)
         self.passives = {}
         for p in PASSIVE_POOL:
             self.passives[p["id"]] = {"data": p, "stack": 0}
@@ -446,16 +907,16 @@ class PassiveTracker:
             p = self.passives[pid]
             icon_rect = pygame.Rect(self.rect.x + padding, y, 40, 40)
             pygame.draw.circle(surface, p["data"]["icon_color"], icon_rect.center, 20)
-            txt = self.font.render(p["data"]["name"], True, BLACK)
+            txt = TEXT_CACHE.render(self.font, p["data"]["name"], BLACK)
             surface.blit(txt, txt.get_rect(midleft=(icon_rect.right+5, icon_rect.centery)))
             if p["stack"] > 0:
-                stack_txt = self.font.render(str(p["stack"]), True, RED)
+                stack_txt = TEXT_CACHE.render(self.font, str(p["stack"]), RED)
                 surface.blit(stack_txt, (icon_rect.right-10, icon_rect.bottom-15))
             y += 40 + padding
 
 class InfoScreen:
     def __init__(self, font):
-        self.font = INFO_FONT
+        self.font = FONTS.get(24)
         self.pages = ["How to Play", "Spellbook", "Demonology", "Passives"]
         self.current_page = "How to Play"
         self.page_buttons = []
@@ -487,10 +948,10 @@ class InfoScreen:
         pygame.draw.rect(surface, BLACK, content_rect, 3, border_radius=8)
         if self.current_page == "How to Play":
             instructions = ("Place towers for 25 gold each. Right-click to upgrade (3 levels). Press SPACE or START to begin a wave. Every 5 rounds, the enemy count doubles.")
-            lines = wrap_text(instructions, self.font, content_rect.width-10)
+            lines = TEXT_CACHE.wrap(instructions, self.font, content_rect.width-10)
             y_text = content_rect.top+8
             for line in lines:
-                t = self.font.render(line, True, BLACK)
+                t = TEXT_CACHE.render(self.font, line, BLACK)
                 surface.blit(t, (content_rect.left+8, y_text))
                 y_text += self.font.get_linesize()+4
         elif self.current_page == "Spellbook":
@@ -529,13 +990,96 @@ class InfoScreen:
                 return "reset"
         return "stay"
 
+class RunRNG:
+    STREAMS = ("spawn", "path", "deck", "passive", "background", "strategy")
+    def __init__(self, seed=None):
+        self.seed = seed if seed is not None else random.SystemRandom().randrange(2**32)
+        for name in self.STREAMS:
+            setattr(self, name, self.stream(name))
+    def stream(self, name):
+        return random.Random(f"{self.seed}:{name}")
+
+FX_RNG = random.Random()
+
+class SpatialHash:
+    def __init__(self, cell_size=None):
+        self.cell_size = cell_size or CELL_SIZE
+        self.buckets = {}
+        self.size = 0
+    def clear(self):
+        self.buckets.clear()
+        self.size = 0
+    def cell_of(self, pos):
+        return (int(pos[0] // self.cell_size), int(pos[1] // self.cell_size))
+    def insert(self, item, pos):
+        self.buckets.setdefault(self.cell_of(pos), []).append((self.size, item, pos[0], pos[1]))
+        self.size += 1
+    def rebuild(self, items, cell_size=None, positions=None):
+        if cell_size: self.cell_size = cell_size
+        self.clear()
+        if positions is None:
+            for item in items:
+                if item.alive:
+                    self.insert(item, item.pos)
+            return
+        cs = self.cell_size
+        buckets = self.buckets
+        for i, (item, x, y) in enumerate(zip(items, positions[0], positions[1])):
+            key = (int(x // cs), int(y // cs))
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [(i, item, x, y)]
+            else:
+                bucket.append((i, item, x, y))
+        self.size = len(items)
+    def query_radius(self, pos, radius):
+        x, y = pos
+        cs = self.cell_size
+        r2 = radius * radius
+        found = []
+        for cx in range(int((x-radius) // cs), int((x+radius) // cs) + 1):
+            for cy in range(int((y-radius) // cs), int((y+radius) // cs) + 1):
+                bucket = self.buckets.get((cx, cy))
+                if not bucket: continue
+                for entry in bucket:
+                    dx = entry[2]-x; dy = entry[3]-y
+                    if dx*dx + dy*dy <= r2:
+                        found.append(entry)
+        found.sort(key=lambda entry: entry[0])
+        return [entry[1] for entry in found]
+    def first_in_radius(self, pos, radius):
+        for item in self.query_radius(pos, radius):
+            if item.alive: return item
+        return None
+
+class RoutePath:
+    def __init__(self, cells):
+        self.cells = cells
+        self.relayout()
+    def relayout(self):
+        self.points = [(GRID_OFFSET_X + x * CELL_SIZE + CELL_SIZE//2, GRID_OFFSET_Y + y * CELL_SIZE + CELL_SIZE//2) for x, y in self.cells]
+        self.cumulative = [0.0]
+        for (x0, y0), (x1, y1) in zip(self.points, self.points[1:]):
+            self.cumulative.append(self.cumulative[-1] + math.hypot(x1-x0, y1-y0))
+        self.length = self.cumulative[-1]
+    def point_at(self, distance):
+        if distance <= 0: return list(self.points[0])
+        if distance >= self.length: return list(self.points[-1])
+        i = bisect.bisect_right(self.cumulative, distance) - 1
+        seg = self.cumulative[i+1] - self.cumulative[i]
+        t = (distance - self.cumulative[i]) / seg if seg else 0.0
+        (x0, y0), (x1, y1) = self.points[i], self.points[i+1]
+        return [x0 + (x1-x0)*t, y0 + (y1-y0)*t]
+
 class Enemy:
-    def __init__(self, path, speed=50, health=100):
-        self.path = path
-        self.pos = self.grid_to_screen(self.path[0])
+    def __init__(self, route, speed=50, health=100):
+        self.route = route
+        self.path = route.cells
+        self.distance = 0.0
+        self.prev_distance = 0.0
+        self.pos = route.point_at(0.0)
         self.speed = speed
         self.health = health
-        self.current_target_index = 1
         self.alive = True
         self.rewarded = False
         self.slow_timer = 0
@@ -552,21 +1096,13 @@ class Enemy:
         self.anim_timer = 0.1
         self.status_tint = None
         self.tint_timer = 0
-    def grid_to_screen(self, grid_coord):
-        x, y = grid_coord
-        return [GRID_OFFSET_X + x * CELL_SIZE + CELL_SIZE//2,
-                GRID_OFFSET_Y + y * CELL_SIZE + CELL_SIZE//2]
+    @property
+    def progress(self):
+        return self.distance / self.route.length if self.route.length else 1.0
     def update(self, dt):
-        if self.reversed_timer > 0 and self.current_target_index > 0:
-            target = self.grid_to_screen(self.path[self.current_target_index-1])
+        backwards = self.reversed_timer > 0
+        if backwards:
             self.reversed_timer -= dt
-            if self.reversed_timer <= 0:
-                target = self.grid_to_screen(self.path[self.current_target_index])
-            else:
-                if math.hypot(self.pos[0]-target[0], self.pos[1]-target[1]) < 5:
-                    self.current_target_index = max(self.current_target_index-1, 0)
-        else:
-            target = self.grid_to_screen(self.path[self.current_target_index])
         if self.slow_timer > 0:
             self.slow_timer -= dt
             if self.slow_timer <= 0: self.slow_factor = 1.0
@@ -577,49 +1113,234 @@ class Enemy:
             self.tint_timer -= dt
         else:
             self.status_tint = None
-        if not self.alive or self.current_target_index >= len(self.path): return
-        dx = target[0]-self.pos[0]
-        dy = target[1]-self.pos[1]
-        distance = math.hypot(dx,dy)
-        if distance:
-            dir_x, dir_y = dx/distance, dy/distance
-        else:
-            dir_x, dir_y = 0,0
-        current_speed = self.speed * self.slow_factor
-        travel = current_speed * dt
-        if travel >= distance:
-            self.pos = target
-            if self.reversed_timer > 0 and self.current_target_index > 0:
-                self.current_target_index = max(self.current_target_index-1, 0)
-            else:
-                self.current_target_index += 1
-        else:
-            self.pos[0] += dir_x * travel
-            self.pos[1] += dir_y * travel
+        if not self.alive or self.reached_end(): return
+        travel = self.speed * self.slow_factor * dt
+        self.distance = max(self.distance - travel, 0.0) if backwards else self.distance + travel
+        self.pos = self.route.point_at(self.distance)
         self.anim_timer -= dt
         if self.anim_timer <= 0:
             self.anim_frame = (self.anim_frame+1) % 6
             self.anim_timer = 0.1
-    def draw(self, surface):
+    def render_pos(self, alpha):
+        if alpha >= 1.0 or self.prev_distance == self.distance:
+            return self.pos
+        return self.route.point_at(self.prev_distance + (self.distance - self.prev_distance) * alpha)
+    def draw(self, surface, pos=None):
+        x, y = pos if pos is not None else self.pos
         if self.sprites:
-            pos_int = (int(self.pos[0])-20, int(self.pos[1])-20)
+            pos_int = (int(x)-20, int(y)-20)
             surface.blit(self.sprites[self.anim_frame], pos_int)
         bar_width = 30; bar_height = 4; ratio = max(self.health,0)/100
-        bar_x = int(self.pos[0])-bar_width//2; bar_y = int(self.pos[1])-26
+        bar_x = int(x)-bar_width//2; bar_y = int(y)-26
         pygame.draw.rect(surface, BLACK, (bar_x, bar_y, bar_width, bar_height))
-        pygame.draw.rect(surface, GREEN, (bar_x, bar_y, int(bar_width*ratio), bar_height))
+        bar = pygame.draw.rect(surface, GREEN, (bar_x, bar_y, int(bar_width*ratio), bar_height))
         if self.status_tint:
             tint = pygame.Surface((40,40), pygame.SRCALPHA)
             tint.fill(self.status_tint)
-            surface.blit(tint, (int(self.pos[0])-20, int(self.pos[1])-20))
+            surface.blit(tint, (int(x)-20, int(y)-20))
+        return bar.union((int(x)-20, bar_y, 40, 46))
     def take_damage(self, dmg):
         self.health -= dmg
         if self.health <= 0: self.alive = False
     def reached_end(self):
-        return self.current_target_index >= len(self.path)
+        return self.distance >= self.route.length
+
+class EnemyStore:
+    FLOAT_FIELDS = ("x", "y", "distance", "prev_distance", "speed", "health", "slow_timer", "slow_factor", "dot_timer", "dot_damage",
+                    "reversed_timer", "anim_timer", "tint_timer")
+    INT_FIELDS = ("anim_frame", "route")
+    BOOL_FIELDS = ("alive", "tint_on")
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.count = 0
+        self.views = []
+        for name in self.FLOAT_FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=np.float64))
+        for name in self.INT_FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=np.int64))
+        for name in self.BOOL_FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=bool))
+        self.route_ids = {}
+        self.route_paths = []
+        self.route_length = np.zeros(0)
+    def fields(self):
+        return self.FLOAT_FIELDS + self.INT_FIELDS + self.BOOL_FIELDS
+    def set_routes(self, routes):
+        self.route_paths = list(routes)
+        self.route_ids = {id(route): i for i, route in enumerate(self.route_paths)}
+        self.route_arrays = [(np.array(route.cumulative), np.array([p[0] for p in route.points], dtype=np.float64),
+                              np.array([p[1] for p in route.points], dtype=np.float64)) for route in self.route_paths]
+        self.route_length = np.array([route.length for route in self.route_paths], dtype=np.float64)
+        self.place(np.ones(self.count, dtype=bool))
+    def place(self, rows):
+        n = self.count
+        route = self.route[:n]
+        for i, (cumulative, xs, ys) in enumerate(self.route_arrays):
+            sel = rows & (route == i)
+            if sel.any():
+                d = self.distance[:n][sel]
+                self.x[:n][sel] = np.interp(d, cumulative, xs)
+                self.y[:n][sel] = np.interp(d, cumulative, ys)
+    def grow(self):
+        self.capacity *= 2
+        for name in self.fields():
+            old = getattr(self, name)
+            new = np.zeros(self.capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+    def spawn(self, route, speed=50, health=100):
+        if id(route) not in self.route_ids:
+            self.set_routes(self.route_paths + [route])
+        if self.count >= self.capacity:
+            self.grow()
+        row = self.count
+        self.count += 1
+        for name in self.fields():
+            getattr(self, name)[row] = 0
+        self.route[row] = self.route_ids[id(route)]
+        view = StoredEnemy(self, row, route, speed, health)
+        self.views.append(view)
+        return view
+    def step(self, dt):
+        n = self.count
+        if n == 0: return
+        live = self.alive[:n].copy()
+        rt = self.reversed_timer[:n]
+        backwards = live & (rt > 0)
+        rt[backwards] -= dt
+        slowed = live & (self.slow_timer[:n] > 0)
+        self.slow_timer[:n][slowed] -= dt
+        self.slow_factor[:n][slowed & (self.slow_timer[:n] <= 0)] = 1.0
+        dotted = live & (self.dot_timer[:n] > 0)
+        self.health[:n][dotted] -= self.dot_damage[:n][dotted] * dt
+        self.dot_timer[:n][dotted] -= dt
+        self.alive[:n][dotted & (self.health[:n] <= 0)] = False
+        tinted = live & (self.tint_timer[:n] > 0)
+        self.tint_timer[:n][tinted] -= dt
+        self.tint_on[:n][live & ~tinted] = False
+        distance = self.distance[:n]
+        moving = self.alive[:n] & (distance < self.route_length[self.route[:n]])
+        travel = self.speed[:n] * self.slow_factor[:n] * dt
+        distance[moving] += np.where(backwards, -travel, travel)[moving]
+        np.maximum(distance, 0.0, out=distance)
+        self.place(moving)
+        at = self.anim_timer[:n]
+        at[moving] -= dt
+        flip = moving & (at <= 0)
+        self.anim_frame[:n][flip] = (self.anim_frame[:n][flip] + 1) % 6
+        at[flip] = 0.1
+    def rescale(self, factor):
+        self.distance[:self.count] *= factor
+        self.prev_distance[:self.count] *= factor
+    def snapshot(self):
+        self.prev_distance[:self.count] = self.distance[:self.count]
+    def interpolated_positions(self, alpha):
+        n = self.count
+        distance = self.prev_distance[:n] + (self.distance[:n] - self.prev_distance[:n]) * alpha
+        route = self.route[:n]
+        xs = self.x[:n].copy(); ys = self.y[:n].copy()
+        for i, (cumulative, rxs, rys) in enumerate(self.route_arrays):
+            sel = route == i
+            if sel.any():
+                xs[sel] = np.interp(distance[sel], cumulative, rxs)
+                ys[sel] = np.interp(distance[sel], cumulative, rys)
+        return xs.tolist(), ys.tolist()
+    def positions(self):
+        return self.x[:self.count].tolist(), self.y[:self.count].tolist()
+    def reached_end(self):
+        n = self.count
+        return self.alive[:n] & (self.distance[:n] >= self.route_length[self.route[:n]])
+    def compact(self):
+        n = self.count
+        keep = self.alive[:n]
+        if keep.all(): return []
+        rows = np.flatnonzero(keep)
+        removed = [self.views[i] for i in np.flatnonzero(~keep)]
+        for view in removed:
+            view.detach()
+        for name in self.fields():
+            arr = getattr(self, name)
+            arr[:len(rows)] = arr[rows]
+        self.views[:] = [self.views[i] for i in rows]
+        for row, view in enumerate(self.views):
+            view._row = row
+        self.count = len(rows)
+        return removed
+
+def select_targets(towers, store, passives, dt):
+    candidates = [[] for _ in towers]
+    if not towers or store.count == 0: return candidates
+    ready = [i for i, tower in enumerate(towers) if tower.cooldown - dt <= 0]
+    if not ready: return candidates
+    tower_xy = np.array([towers[i].pos for i in ready], dtype=np.float64)
+    radius = np.array([towers[i].effective_range(passives) for i in ready])
+    n = store.count
+    dx = tower_xy[:, 0, None] - store.x[None, :n]
+    dy = tower_xy[:, 1, None] - store.y[None, :n]
+    in_range = (dx*dx + dy*dy <= (radius*radius)[:, None]) & store.alive[None, :n]
+    first = in_range.argmax(axis=1).tolist()
+    hit = in_range[np.arange(len(ready)), first].tolist()
+    for row, i in enumerate(ready):
+        if hit[row]:
+            candidates[i] = _row_candidates(store.views, in_range[row], first[row])
+    return candidates
+
+def _row_candidates(views, row, first):
+    yield views[first]
+    for j in np.flatnonzero(row[first+1:]).tolist():
+        yield views[first+1+j]
+
+def _store_field(name, convert):
+    def get(self):
+        if self._store is None: return self._frozen[name]
+        return convert(getattr(self._store, name)[self._row])
+    def set(self, value):
+        if self._store is None: self._frozen[name] = value
+        else: getattr(self._store, name)[self._row] = value
+    return property(get, set)
+
+class StoredEnemy(Enemy):
+    def __init__(self, store, row, route, speed=50, health=100):
+        self._store = store
+        self._row = row
+        self._frozen = None
+        self._status_tint = None
+        Enemy.__init__(self, route, speed=speed, health=health)
+    def detach(self):
+        self._frozen = {name: getattr(self._store, name)[self._row].item() for name in self._store.fields()}
+        self._store = None
+    @property
+    def pos(self):
+        return [self.x, self.y]
+    @pos.setter
+    def pos(self, value):
+        self.x, self.y = value[0], value[1]
+    @property
+    def status_tint(self):
+        return self._status_tint if self.tint_on else None
+    @status_tint.setter
+    def status_tint(self, value):
+        self._status_tint = value
+        self.tint_on = value is not None
+    x = _store_field("x", float)
+    y = _store_field("y", float)
+    distance = _store_field("distance", float)
+    prev_distance = _store_field("prev_distance", float)
+    speed = _store_field("speed", float)
+    health = _store_field("health", float)
+    slow_timer = _store_field("slow_timer", float)
+    slow_factor = _store_field("slow_factor", float)
+    dot_timer = _store_field("dot_timer", float)
+    dot_damage = _store_field("dot_damage", float)
+    reversed_timer = _store_field("reversed_timer", float)
+    anim_timer = _store_field("anim_timer", float)
+    tint_timer = _store_field("tint_timer", float)
+    anim_frame = _store_field("anim_frame", int)
+    alive = _store_field("alive", bool)
+    tint_on = _store_field("tint_on", bool)
 
 class Tower:
-    def __init__(self, grid_pos, tower_spec):
+    def __init__(self, grid_pos, tower_spec, render=True):
         self.grid_pos = grid_pos
         self.pos = self.grid_to_screen(grid_pos)
         self.tower_spec = tower_spec.copy()
@@ -630,43 +1351,55 @@ class Tower:
         self.upgrade_level = 0
         self.show_range = True
         self.range_display_timer = 0
-        sprite_set = create_tower_attack_sprites(tower_spec)
-        self.idle_sprite = sprite_set["idle"]
-        self.attack_sprites = sprite_set["attack"]
+        self.idle_sprite = None
+        self.attack_sprites = None
+        if render:
+            sprite_set = get_tower_sprites(tower_spec)
+            self.idle_sprite = sprite_set["idle"]
+            self.attack_sprites = sprite_set["attack"]
         self.attack_anim_frame = 0
         self.attack_anim_timer = 0.2
     def grid_to_screen(self, grid_coord):
         x, y = grid_coord
         return [GRID_OFFSET_X + x * CELL_SIZE + CELL_SIZE//2,
                 GRID_OFFSET_Y + y * CELL_SIZE + CELL_SIZE//2]
-    def update(self, dt, demons, animations, passives):
+    def update(self, dt, demons, animations, passives, spatial_hash=None, candidates=None):
         if self.range_display_timer > 0:
             self.range_display_timer -= dt
         else:
             self.show_range = False
         self.cooldown -= dt
-        effective_range = self.range_radius * passives["range"]
+        effective_range = self.effective_range(passives)
         effective_rate = self.attack_rate * passives["attack_speed"]
-        for demon in demons:
-            if demon.alive:
-                dist = math.hypot(demon.pos[0]-self.pos[0], demon.pos[1]-self.pos[1])
-                if dist <= effective_range and self.cooldown <= 0:
-                    dmg = self.damage * passives["damage"]
-                    design = self.tower_spec.get("design")
-                    if "hybrid" in self.tower_spec:
-                        split_dmg = dmg / len(self.tower_spec["hybrid"])
-                        for elem in self.tower_spec["hybrid"]:
-                            apply_effect(elem, demon, split_dmg, animations, self.pos)
-                        self.cooldown = 1.0 / effective_rate
-                    else:
-                        apply_effect(design, demon, dmg, animations, self.pos)
-                        self.cooldown = 1.0 / effective_rate
-                    self.attack_anim_timer = 0.2
-                    break
+        if self.cooldown <= 0:
+            if candidates is not None:
+                target = next((demon for demon in candidates if demon.alive), None)
+            elif spatial_hash is not None:
+                target = spatial_hash.first_in_radius(self.pos, effective_range)
+            else:
+                target = None
+                for demon in demons:
+                    if demon.alive and math.hypot(demon.pos[0]-self.pos[0], demon.pos[1]-self.pos[1]) <= effective_range:
+                        target = demon
+                        break
+            if target is not None:
+                self.fire(target, animations, passives)
+                self.cooldown = 1.0 / effective_rate
+                self.attack_anim_timer = 0.2
         self.attack_anim_timer -= dt
         if self.attack_anim_timer <= 0:
             self.attack_anim_frame = (self.attack_anim_frame+1) % 6
             self.attack_anim_timer = 0.2
+    def fire(self, demon, animations, passives):
+        dmg = self.damage * passives["damage"]
+        if "hybrid" in self.tower_spec:
+            split_dmg = dmg / len(self.tower_spec["hybrid"])
+            for elem in self.tower_spec["hybrid"]:
+                apply_effect(elem, demon, split_dmg, animations, self.pos)
+        else:
+            apply_effect(self.tower_spec.get("design"), demon, dmg, animations, self.pos)
+    def effective_range(self, passives):
+        return self.range_radius * passives["range"]
     def draw(self, surface):
         pos_int = (int(self.pos[0])-32, int(self.pos[1])-32)
         if self.cooldown > 0.1:
@@ -677,19 +1410,25 @@ class Tower:
             pygame.draw.rect(surface, GOLD, (int(self.pos[0])-32, int(self.pos[1])-32, 12, 12))
         if self.upgrade_level >= 2:
             pygame.draw.rect(surface, YELLOW, (int(self.pos[0])-20, int(self.pos[1])-32, 12, 12))
+        return pygame.Rect(pos_int, (64, 64))
 
 class FancyAttackAnimation:
     def __init__(self, start, end, duration, color, element=None):
-        self.start = start.copy()
-        self.end = end.copy()
+        self.start = [0, 0]
+        self.end = [0, 0]
+        self.projectile_pos = [0, 0]
+        self.reset(start, end, duration, color, element)
+    def reset(self, start, end, duration, color, element=None):
+        self.start[0], self.start[1] = start[0], start[1]
+        self.end[0], self.end[1] = end[0], end[1]
         self.duration = duration
         self.elapsed = 0.0
         self.color = color
         self.element = element
-        self.projectile_sprites = create_projectile_sprites(element) if element else None
+        self.projectile_sprites = PROJECTILE_SPRITE_CACHE.get(element) if element else None
         self.anim_frame = 0
         self.anim_timer = 0.1
-        self.projectile_pos = start.copy()
+        self.projectile_pos[0], self.projectile_pos[1] = start[0], start[1]
     def update(self, dt):
         self.elapsed += dt
         if self.projectile_sprites:
@@ -706,17 +1445,56 @@ class FancyAttackAnimation:
             surface.blit(self.projectile_sprites[self.anim_frame], (pos[0]-8, pos[1]-8))
         else:
             pygame.draw.circle(surface, self.color, pos, 6)
+        rect = pygame.Rect(pos[0]-12, pos[1]-12, 25, 25)
         if self.element == "toxin":
             pygame.draw.circle(surface, (75,0,130,100), pos, 12)
         elif self.element == "lightning":
-            mid = ((self.start[0]+self.end[0])//2 + random.randint(-5,5),
-                   (self.start[1]+self.end[1])//2 + random.randint(-5,5))
-            pygame.draw.lines(surface, (255,0,0), False, [self.start, mid, self.end], 2)
+            mid = ((self.start[0]+self.end[0])//2 + FX_RNG.randint(-5,5),
+                   (self.start[1]+self.end[1])//2 + FX_RNG.randint(-5,5))
+            rect.union_ip(pygame.draw.lines(surface, (255,0,0), False, [self.start, mid, self.end], 2))
         elif self.element == "flame":
             pygame.draw.circle(surface, (255,69,0), pos, 10, 2)
+        return rect
     def is_finished(self):
         return self.elapsed >= self.duration
 
+class ProjectilePool:
+    def __init__(self, cap=PROJECTILE_POOL_CAP):
+        self.cap = cap
+        self.active = []
+        self.free = []
+        self.recycled = 0
+    def spawn(self, start, end, duration, color, element=None):
+        if self.free:
+            anim = self.free.pop()
+        elif len(self.active) >= self.cap:
+            anim = self.active.pop(0)
+            self.recycled += 1
+        else:
+            self.active.append(FancyAttackAnimation(start, end, duration, color, element))
+            return self.active[-1]
+        anim.reset(start, end, duration, color, element)
+        self.active.append(anim)
+        return anim
+    def update(self, dt):
+        write = 0
+        active = self.active
+        for anim in active:
+            anim.update(dt)
+            if anim.is_finished():
+                self.free.append(anim)
+            else:
+                active[write] = anim
+                write += 1
+        del active[write:]
+    def clear(self):
+        self.free.extend(self.active)
+        self.active.clear()
+    def __iter__(self):
+        return iter(self.active)
+    def __len__(self):
+        return len(self.active)
+
 def apply_effect(element, demon, dmg, animations, tower_pos):
     if element == "frost":
         demon.slow_factor = 0.5; demon.slow_timer = 2
@@ -735,7 +1513,7 @@ def apply_effect(element, demon, dmg, animations, tower_pos):
     demon.take_damage(dmg)
     if element in element_tints:
         demon.tint_timer = 1.0; demon.status_tint = element_tints[element]
-    animations.append(FancyAttackAnimation(tower_pos, demon.pos, 0.3, demon.custom_color if hasattr(demon, "custom_color") else RED, element=element))
+    animations.spawn(tower_pos, demon.pos, 0.3, demon.custom_color if hasattr(demon, "custom_color") else RED, element=element)
 
 VIRTUAL_WIDTH = 1280
 VIRTUAL_HEIGHT = 720
@@ -757,15 +1535,149 @@ def recalc_layout():
 
 recalc_layout()
 
-class GameManager:
-    def __init__(self):
-        self.clock = pygame.time.Clock()
-        self.font = FANTASY_FONT
+def set_virtual_size(width, height):
+    global VIRTUAL_WIDTH, VIRTUAL_HEIGHT
+    VIRTUAL_WIDTH, VIRTUAL_HEIGHT = width, height
+    recalc_layout()
+
+class LayerCompositor:
+    LAYERS = ("static", "semi_static")
+    EVENTS = {
+        "rebuild_ui": ("static", "semi_static"),
+        "purchase": ("semi_static",),
+        "passive_chosen": ("semi_static",),
+        "wave_started": ("semi_static",),
+        "state_changed": ("semi_static",),
+    }
+    def __init__(self, paint_static, paint_semi_static):
+        self.painters = {"static": paint_static, "semi_static": paint_semi_static}
+        self.surfaces = {}
+        self.stale = set(self.LAYERS)
+        self.composed = None
+        self.version = 0
+        self.state = None
+    def invalidate(self, event):
+        self.stale.update(self.EVENTS[event])
+    def sync_state(self, state):
+        if state != self.state:
+            self.state = state
+            self.invalidate("state_changed")
+    def layer(self, name, size):
+        surf = self.surfaces.get(name)
+        if surf is None or surf.get_size() != size:
+            surf = self.surfaces[name] = pygame.Surface(size) if name == "static" else pygame.Surface(size, pygame.SRCALPHA)
+            self.stale.add(name)
+        if name in self.stale:
+            if name != "static": surf.fill((0,0,0,0))
+            self.painters[name](surf)
+        return surf
+    def base(self, size):
+        if self.composed is None or self.composed.get_size() != size:
+            self.composed = pygame.Surface(size)
+            self.stale.update(self.LAYERS)
+        if self.stale:
+            layers = [self.layer(name, size) for name in self.LAYERS]
+            self.stale.clear()
+            self.composed.blit(layers[0], (0,0))
+            for layer in layers[1:]:
+                self.composed.blit(layer, (0,0))
+            self.version += 1
+        return self.composed
+
+class NullEffects:
+    def spawn(self, start, end, duration, color, element=None):
+        return None
+    def update(self, dt):
+        pass
+    def clear(self):
+        pass
+    def __iter__(self):
+        return iter(())
+    def __len__(self):
+        return 0
+
+def route_settings():
+    return ROUTE_COUNT, ROUTE_MIN_LENGTH or 0, ROUTE_MAX_LENGTH or 0
+
+REPLAY_MAGIC = b"STRP"
+REPLAY_VERSION = 4
+REPLAY_ACTIONS = ("buy", "place", "upgrade", "passive", "wave", "resize")
+
+class Replay:
+    HEADER = struct.Struct("<BqHHHHHHHI")
+    RECORD = struct.Struct("<IBhh")
+    def __init__(self, seed, layout=None, actions=None):
+        self.seed = seed
+        self.layout = layout or (VIRTUAL_WIDTH, VIRTUAL_HEIGHT, GRID_WIDTH, GRID_HEIGHT, *route_settings())
+        self.actions = actions if actions is not None else []
+    def record(self, tick, action, a=0, b=0):
+        self.actions.append((tick, REPLAY_ACTIONS.index(action), a, b))
+    def restart(self, seed):
+        self.__init__(seed)
+    def to_bytes(self):
+        body = [self.HEADER.pack(REPLAY_VERSION, self.seed, *self.layout, len(self.actions))]
+        body.extend(self.RECORD.pack(*action) for action in self.actions)
+        return REPLAY_MAGIC + zlib.compress(b"".join(body), 9)
+    @classmethod
+    def from_bytes(cls, data):
+        if data[:len(REPLAY_MAGIC)] != REPLAY_MAGIC:
+            raise ValueError("not a Spelltower Clash replay")
+        body = zlib.decompress(data[len(REPLAY_MAGIC):])
+        version, seed, vw, vh, gw, gh, routes, min_length, max_length, count = cls.HEADER.unpack_from(body)
+        if version != REPLAY_VERSION:
+            raise ValueError(f"unsupported replay version {version}")
+        if (gw, gh) != (GRID_WIDTH, GRID_HEIGHT):
+            raise ValueError(f"replay was recorded on a {gw}x{gh} grid")
+        if (routes, min_length, max_length) != route_settings():
+            raise ValueError(f"replay was recorded with {routes} routes of length {min_length or 'default'}-{max_length or 'default'}")
+        end = cls.HEADER.size + count * cls.RECORD.size
+        return cls(seed, (vw, vh, gw, gh, routes, min_length, max_length), list(cls.RECORD.iter_unpack(body[cls.HEADER.size:end])))
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+class ReplayPlayer:
+    def __init__(self, sim, replay):
+        self.sim = sim
+        self.actions = replay.actions
+        self.index = 0
+    @property
+    def done(self):
+        return self.index >= len(self.actions)
+    def apply_due(self):
+        while not self.done and self.actions[self.index][0] <= self.sim.tick:
+            tick, action, a, b = self.actions[self.index]
+            self.sim.apply_action(REPLAY_ACTIONS[action], a, b)
+            self.index += 1
+    def step(self, dt):
+        self.apply_due()
+        self.sim.update(dt)
+
+class Simulation:
+    def __init__(self, effects=None, render=False, seed=None, tower_pool=None, spawn_table=None):
+        self.render = render
+        self.rng = RunRNG(seed)
+        self.tower_pool = tower_pool or TOWER_POOL
+        self.spawn_table = spawn_table or DEMON_SPAWN_TABLE
+        self.leaks = Counter()
         self.passive_upgrades = {"attack_speed": 1.0, "damage": 1.0, "gold": 1.0, "range": 1.0, "upgrade_cost": 1.0}
-        self.routes = []
-        initial_route = PathGenerator(GRID_WIDTH, GRID_HEIGHT).generate_path()
-        self.routes.append(initial_route)
+        self.passive_stacks = {p["id"]: 0 for p in PASSIVE_POOL}
+        self.routes = PathGenerator(GRID_WIDTH, GRID_HEIGHT, rng=self.rng.path).generate_routes(ROUTE_COUNT, ROUTE_MIN_LENGTH, ROUTE_MAX_LENGTH)
+        self.route_paths = [RoutePath(route) for route in self.routes]
+        self.board = Board(GRID_WIDTH, GRID_HEIGHT)
+        for route in self.routes:
+            self.board.mark_path(route)
         self.enemies = []
+        self.enemy_store = EnemyStore() if np is not None else None
+        if self.enemy_store is not None:
+            self.enemy_store.set_routes(self.route_paths)
+            self.enemies = self.enemy_store.views
+        self.enemy_hash = SpatialHash(CELL_SIZE)
+        self.enemy_hash_dirty = True
         self.towers = []
         self.player_health = 10
         self.gold = 100
@@ -773,62 +1685,142 @@ class GameManager:
         self.spawn_timer = 0
         self.spawn_interval = 0.5
         self.enemies_to_spawn = 0
-        self.state = "intro"
-        self.tower_deck = TowerDeck(deck_size=3)
+        self.state = "deck"
+        self.tower_deck = TowerDeck(deck_size=3, render=render, rng=self.rng.deck, pool=self.tower_pool)
         self.current_tower_selection = None
-        self.attack_animations = []
-        self.top_panel = pygame.Surface((VIRTUAL_WIDTH, TOP_PANEL_HEIGHT))
-        self.top_panel.fill(DARK_GRAY)
-        self.passive_tracker = PassiveTracker(self.font)
-        self.info_button_rect = pygame.Rect(LEFT_PANEL_WIDTH, TOP_PANEL_HEIGHT+GAME_BOARD_HEIGHT, central_width, INFO_PANEL_HEIGHT)
-        self.info_screen = InfoScreen(self.font)
-        self.grid_background = self.create_grid_background()
+        self.attack_animations = effects if effects is not None else NullEffects()
         self.special_enemy_level = 0
-        self.pending_upgrade_tower = None
-        self.intro_start_button = None
-        self.start_pause_button_rect = pygame.Rect(VIRTUAL_WIDTH-150, VIRTUAL_HEIGHT-80, 140, 60)
         self.passive_choices = []
-        self.background_texture = create_background_texture(VIRTUAL_WIDTH, VIRTUAL_HEIGHT)
-        self.previous_state = "deck"
         self.wave_timer = 0
-        self.castle_sprite = create_castle_sprite()
+        self.tick = 0
+        self.recorder = None
+    def notify(self, event):
+        pass
+    def record(self, action, a=0, b=0):
+        if self.recorder is not None:
+            self.recorder.record(self.tick, action, a, b)
+    def apply_action(self, action, a=0, b=0):
+        if action == "buy":
+            self.buy_tower(a)
+        elif action == "place":
+            self.place_tower((a, b))
+        elif action == "upgrade":
+            self.upgrade_tower(self.tower_at((a, b)))
+        elif action == "passive":
+            self.choose_passive(PASSIVE_POOL[a])
+        elif action == "wave":
+            self.start_wave()
+        elif action == "resize":
+            set_virtual_size(a, b)
+            self.rebuild_ui()
+    @traced
+    def rebuild_ui(self):
+        old_cell_size = CELL_SIZE
+        recalc_layout()
+        for route in self.route_paths:
+            route.relayout()
+        if CELL_SIZE != old_cell_size:
+            if self.enemy_store is not None:
+                self.enemy_store.rescale(CELL_SIZE / old_cell_size)
+            else:
+                for demon in self.enemies:
+                    demon.distance *= CELL_SIZE / old_cell_size
+                    demon.prev_distance *= CELL_SIZE / old_cell_size
+        if self.enemy_store is not None:
+            self.enemy_store.set_routes(self.route_paths)
+        else:
+            for demon in self.enemies:
+                demon.pos = demon.route.point_at(demon.distance)
+        self.tower_deck.layout()
+        self.record("resize", VIRTUAL_WIDTH, VIRTUAL_HEIGHT)
     def update(self, dt):
         if self.state in ["intro", "upgrade_menu", "info"]:
             return
         if self.state == "playing":
+            self.tick += 1
+            self.snapshot()
             self.wave_timer += dt
             if self.enemies_to_spawn > 0:
                 self.spawn_timer -= dt
                 if self.spawn_timer <= 0:
                     self.spawn_enemy()
                     self.spawn_timer = self.spawn_interval
-            for demon in self.enemies:
-                if demon.alive:
-                    demon.update(dt)
-                    if demon.reached_end():
-                        demon.alive = False
-                        self.player_health -= 1
-                        if self.player_health <= 0:
-                            self.state = "gameover"
-                else:
-                    if not hasattr(demon, "rewarded") or not demon.rewarded:
-                        self.gold += int(10 * self.passive_upgrades["gold"])
-                        demon.rewarded = True
-            self.enemies = [d for d in self.enemies if d.alive]
-            for spelltower in self.towers:
-                spelltower.update(dt, self.enemies, self.attack_animations, self.passive_upgrades)
-            for anim in self.attack_animations:
-                anim.update(dt)
-            self.attack_animations = [anim for anim in self.attack_animations if not anim.is_finished()]
+            if PROFILER.enabled:
+                PROFILER.lap("spawn")
+            if self.enemy_store is not None:
+                self.update_enemy_store(dt)
+            else:
+                for demon in self.enemies:
+                    if demon.alive:
+                        demon.update(dt)
+                        if demon.reached_end():
+                            demon.alive = False
+                            self.leaks[demon.type] += 1
+                            self.player_health -= 1
+                            if self.player_health <= 0:
+                                self.state = "gameover"
+                    else:
+                        if not hasattr(demon, "rewarded") or not demon.rewarded:
+                            self.gold += int(10 * self.passive_upgrades["gold"])
+                            demon.rewarded = True
+                self.enemies = [d for d in self.enemies if d.alive]
+            self.enemy_hash_dirty = True
+            if PROFILER.enabled:
+                PROFILER.lap("demons")
+            if self.enemy_store is not None:
+                targets = select_targets(self.towers, self.enemy_store, self.passive_upgrades, dt)
+                for spelltower, candidates in zip(self.towers, targets):
+                    spelltower.update(dt, self.enemies, self.attack_animations, self.passive_upgrades, candidates=candidates)
+            else:
+                for spelltower in self.towers:
+                    spelltower.update(dt, self.enemies, self.attack_animations, self.passive_upgrades, self.spatial_index())
+            if PROFILER.enabled:
+                PROFILER.lap("towers")
+            self.attack_animations.update(dt)
+            if PROFILER.enabled:
+                PROFILER.lap("animations")
             if self.wave_timer > 3.0 and self.enemies_to_spawn <= 0 and len(self.enemies) == 0:
-                self.passive_choices = random.sample(PASSIVE_POOL, 2)
+                self.passive_choices = self.rng.passive.sample(PASSIVE_POOL, 2)
                 self.state = "passive_choice"
         elif self.state == "paused":
             pass
+    def snapshot(self):
+        if self.enemy_store is not None:
+            self.enemy_store.snapshot()
+        else:
+            for demon in self.enemies:
+                demon.prev_distance = demon.distance
+    def spatial_index(self):
+        if self.enemy_hash_dirty:
+            if self.enemy_store is not None:
+                self.enemy_hash.rebuild(self.enemies, CELL_SIZE, self.enemy_store.positions())
+            else:
+                self.enemy_hash.rebuild(self.enemies, CELL_SIZE)
+            self.enemy_hash_dirty = False
+        return self.enemy_hash
+    def update_enemy_store(self, dt):
+        store = self.enemy_store
+        for demon in store.compact():
+            if not demon.rewarded:
+                self.gold += int(10 * self.passive_upgrades["gold"])
+                demon.rewarded = True
+        store.step(dt)
+        leaked = store.reached_end()
+        for row in np.flatnonzero(leaked):
+            self.leaks[store.views[row].type] += 1
+            self.player_health -= 1
+            if self.player_health <= 0:
+                self.state = "gameover"
+        store.alive[:store.count][leaked] = False
+        for demon in store.compact():
+            demon.rewarded = True
+        self.enemies = store.views
+    @traced
     def start_wave(self):
+        self.record("wave")
         self.wave += 1
         self.wave_timer = 0
-        self.tower_deck = TowerDeck(deck_size=3)
+        self.tower_deck = TowerDeck(deck_size=3, render=self.render, rng=self.rng.deck, pool=self.tower_pool)
         for tower in self.towers:
             tower.show_range = False
             tower.range_display_timer = 0
@@ -839,113 +1831,164 @@ class GameManager:
             self.enemies_to_spawn = base_count
         self.spawn_timer = self.spawn_interval
         self.state = "playing"
+        self.notify("wave_started")
+    @traced
     def spawn_enemy(self):
         base_speed = 50 + self.wave * 1.0
         base_health = 100 + self.wave * 1
-        r = random.random()
-        demon = None
-        if r < 0.10:
-            speed = base_speed * 1.5; health = int(base_health * 0.7)
-            color = (255,100,150)
-            demon = Enemy(random.choice(self.routes), speed=speed, health=health)
-            demon.custom_color = color; demon.type = "Fast Demon"; demon.element = "wind"; demon.weakness = "frost"
-        elif r < 0.20:
-            speed = base_speed * 0.7; health = int(base_health * 2)
-            color = (50,150,200)
-            demon = Enemy(random.choice(self.routes), speed=speed, health=health)
-            demon.custom_color = color; demon.type = "Tank Demon"; demon.element = "earth"; demon.weakness = "shield"
-        elif r < 0.30:
-            speed = base_speed; health = int(base_health * 0.8)
-            color = (150,150,50)
-            demon = Enemy(random.choice(self.routes), speed=speed, health=health)
-            demon.custom_color = color; demon.type = "Stealth Demon"; demon.element = "shadow"; demon.weakness = "swirl"
-        elif r < 0.40:
-            speed = base_speed + 5; health = int(base_health * 1.2)
-            color = (200,100,255)
-            demon = Enemy(random.choice(self.routes), speed=speed, health=health)
-            demon.custom_color = color; demon.type = "Special Demon"; demon.element = "fire"; demon.weakness = "serpent"
-        elif r < 0.50:
-            speed = base_speed; health = base_health
-            color = (100,50,50)
-            demon = Enemy(random.choice(self.routes), speed=speed, health=health)
-            demon.custom_color = color; demon.type = "Dark Demon"; demon.element = "dark"; demon.weakness = "swirl"
-        elif r < 0.60:
-            speed = base_speed * 0.9; health = int(base_health * 1.1)
-            color = (150,220,255)
-            demon = Enemy(random.choice(self.routes), speed=speed, health=health)
-            demon.custom_color = color; demon.type = "Frost Demon"; demon.element = "frost"; demon.weakness = "fire"
-        elif r < 0.70:
-            speed = base_speed * 1.2; health = int(base_health * 0.9)
-            color = (255,255,100)
-            demon = Enemy(random.choice(self.routes), speed=speed, health=health)
-            demon.custom_color = color; demon.type = "Storm Demon"; demon.element = "lightning"; demon.weakness = "arrow"
-        elif r < 0.80:
-            speed = base_speed; health = int(base_health * 1.0)
-            color = (100,0,200)
-            demon = Enemy(random.choice(self.routes), speed=speed, health=health)
-            demon.custom_color = color; demon.type = "Venom Demon"; demon.element = "toxin"; demon.weakness = "holy"
-        elif r < 0.90:
-            speed = base_speed * 0.8; health = int(base_health * 1.5)
-            color = (120,120,120)
-            demon = Enemy(random.choice(self.routes), speed=speed, health=health)
-            demon.custom_color = color; demon.type = "Necro Demon"; demon.element = "shadow"; demon.weakness = "lightning"
-        else:
-            speed = base_speed * 1.1; health = int(base_health * 1.0)
-            color = (255,200,50)
-            demon = Enemy(random.choice(self.routes), speed=speed, health=health)
-            demon.custom_color = color; demon.type = "Celestial Demon"; demon.element = "holy"; demon.weakness = "dark"
-        demon.sprites = create_demon_sprites(demon.type, demon.custom_color if hasattr(demon, "custom_color") else RED)
-        self.enemies.append(demon)
+        r = self.rng.spawn.random()
+        spec = next((spec for spec in self.spawn_table if r < spec["roll"]), self.spawn_table[-1])
+        speed = base_speed * spec["speed"] + spec.get("speed_bonus", 0); health = int(base_health * spec["health"])
+        self.spawn_demon(spec, self.rng.spawn.choice(self.route_paths), speed, health)
         self.enemies_to_spawn -= 1
+    def spawn_demon(self, spec, route, speed, health):
+        demon = self.create_enemy(route, speed=speed, health=health)
+        demon.custom_color = spec["color"]; demon.type = spec["type"]; demon.element = spec["element"]; demon.weakness = spec["weakness"]
+        if self.render:
+            demon.sprites = get_demon_sprites(demon.type, demon.custom_color if hasattr(demon, "custom_color") else RED)
+        return demon
+    def create_enemy(self, path, speed, health):
+        if self.enemy_store is not None:
+            return self.enemy_store.spawn(path, speed=speed, health=health)
+        demon = Enemy(path, speed=speed, health=health)
+        self.enemies.append(demon)
+        return demon
     def upgrade_tower(self, tower):
+        self.record("upgrade", *tower.grid_pos)
         if tower.upgrade_level == 0 and self.gold >= int(30 * self.passive_upgrades["upgrade_cost"]):
             self.gold -= int(30 * self.passive_upgrades["upgrade_cost"])
             tower.attack_rate *= 1.5; tower.range_radius += 15; tower.upgrade_level += 1
-            tower.idle_sprite = add_border(tower.idle_sprite, GOLD, 4)
-            tower.attack_sprites = update_attack_sprites(tower.attack_sprites, GOLD, 4)
+            if tower.idle_sprite is not None:
+                tower.idle_sprite = add_border(tower.idle_sprite, GOLD, 4)
+                tower.attack_sprites = update_attack_sprites(tower.attack_sprites, GOLD, 4)
         elif tower.upgrade_level == 1 and self.gold >= int(50 * self.passive_upgrades["upgrade_cost"]):
             self.gold -= int(50 * self.passive_upgrades["upgrade_cost"])
             tower.attack_rate *= 2; tower.range_radius += 20; tower.upgrade_level += 1
-            tower.idle_sprite = add_border(tower.idle_sprite, YELLOW, 3)
-            tower.attack_sprites = update_attack_sprites(tower.attack_sprites, YELLOW, 3)
+            if tower.idle_sprite is not None:
+                tower.idle_sprite = add_border(tower.idle_sprite, YELLOW, 3)
+                tower.attack_sprites = update_attack_sprites(tower.attack_sprites, YELLOW, 3)
         elif tower.upgrade_level == 2 and self.gold >= int(70 * self.passive_upgrades["upgrade_cost"]):
             self.gold -= int(70 * self.passive_upgrades["upgrade_cost"])
             tower.attack_rate *= 3; tower.range_radius += 25; tower.upgrade_level += 1
-            tower.idle_sprite = add_border(tower.idle_sprite, RED, 3)
-            tower.attack_sprites = update_attack_sprites(tower.attack_sprites, RED, 3)
-        self.attack_animations.append(FancyAttackAnimation(tower.pos, tower.pos, 0.5, GOLD, element="upgrade"))
-    def rebuild_ui(self):
-        recalc_layout()
+            if tower.idle_sprite is not None:
+                tower.idle_sprite = add_border(tower.idle_sprite, RED, 3)
+                tower.attack_sprites = update_attack_sprites(tower.attack_sprites, RED, 3)
+        self.attack_animations.spawn(tower.pos, tower.pos, 0.5, GOLD, element="upgrade")
+    def buy_tower(self, index):
+        if 0 <= index < len(self.tower_deck.buttons) and self.tower_deck.purchase(index, self):
+            self.record("buy", index)
+            return True
+        return False
+    def is_free_cell(self, cell):
+        return self.board.is_free(cell)
+    def add_tower(self, tower):
+        self.board.set(tower.grid_pos, len(self.towers))
+        self.towers.append(tower)
+        return tower
+    def place_tower(self, cell):
+        if self.current_tower_selection and self.is_free_cell(cell):
+            self.record("place", *cell)
+            new_tower = self.add_tower(Tower(cell, self.current_tower_selection, render=self.render))
+            self.current_tower_selection = None
+            return new_tower
+        return None
+    def tower_at(self, cell):
+        index = self.board.at(cell)
+        return self.towers[index] if index is not None and index >= 0 else None
+    def choose_passive(self, passive):
+        self.record("passive", [p["id"] for p in PASSIVE_POOL].index(passive["id"]))
+        self.passive_stacks[passive["id"]] += 1
+        self.state = "deck"
+        self.passive_choices = []
+        self.notify("passive_chosen")
+    def summary(self):
+        return {"wave": self.wave, "waves_survived": self.wave - 1 if self.state == "gameover" else self.wave,
+                "health": self.player_health, "gold": int(self.gold), "towers": len(self.towers),
+                "upgrades": sum(tower.upgrade_level for tower in self.towers)}
+
+class GameManager(Simulation):
+    def __init__(self, seed=None):
+        ASSETS.ensure()
+        Simulation.__init__(self, effects=ProjectilePool(PROJECTILE_POOL_CAP), render=True, seed=seed)
+        self.clock = pygame.time.Clock()
+        self.render_alpha = 1.0
+        self.font = FONTS.get(32)
+        self.state = "intro"
         self.top_panel = pygame.Surface((VIRTUAL_WIDTH, TOP_PANEL_HEIGHT))
         self.top_panel.fill(DARK_GRAY)
+        self.hud_text = None
+        self.compositor = LayerCompositor(self.paint_static_layer, self.paint_semi_static_layer)
+        self.dirty_prev_rects = None
+        self.dirty_base_version = None
+        self.passive_tracker = PassiveTracker(self.font)
+        self.info_button_rect = pygame.Rect(LEFT_PANEL_WIDTH, TOP_PANEL_HEIGHT+GAME_BOARD_HEIGHT, central_width, INFO_PANEL_HEIGHT)
+        self.info_screen = InfoScreen(self.font)
         self.grid_background = self.create_grid_background()
-        self.tower_deck.create_buttons()
+        self.pending_upgrade_tower = None
+        self.intro_start_button = None
+        self.start_pause_button_rect = pygame.Rect(VIRTUAL_WIDTH-150, VIRTUAL_HEIGHT-80, 140, 60)
+        self.background_texture = create_background_texture(VIRTUAL_WIDTH, VIRTUAL_HEIGHT, rng=self.rng.background)
+        self.previous_state = "deck"
+        self.castle_sprite = get_castle_sprite()
+        self.geometry = self.layout_geometry()
+    def notify(self, event):
+        self.compositor.invalidate(event)
+    def choose_passive(self, passive):
+        self.passive_tracker.passives[passive["id"]]["stack"] += 1
+        Simulation.choose_passive(self, passive)
+    def layout_geometry(self):
+        return {"top_panel": VIRTUAL_WIDTH, "grid": CELL_SIZE, "background": (VIRTUAL_WIDTH, VIRTUAL_HEIGHT)}
+    @traced
+    def rebuild_ui(self):
+        Simulation.rebuild_ui(self)
+        geometry = self.layout_geometry()
+        changed = {name for name, value in geometry.items() if self.geometry.get(name) != value}
+        self.geometry = geometry
+        if "top_panel" in changed:
+            self.top_panel = pygame.Surface((VIRTUAL_WIDTH, TOP_PANEL_HEIGHT))
+            self.top_panel.fill(DARK_GRAY)
+            self.hud_text = None
+        if "grid" in changed:
+            DEMON_SPRITE_CACHE.invalidate()
+            self.grid_background = self.create_grid_background()
         self.passive_tracker.rect = pygame.Rect(VIRTUAL_WIDTH - RIGHT_PANEL_WIDTH, TOP_PANEL_HEIGHT, RIGHT_PANEL_WIDTH, VIRTUAL_HEIGHT - TOP_PANEL_HEIGHT - INFO_PANEL_HEIGHT)
         self.info_button_rect = pygame.Rect(LEFT_PANEL_WIDTH, TOP_PANEL_HEIGHT+GAME_BOARD_HEIGHT, central_width, INFO_PANEL_HEIGHT)
         self.start_pause_button_rect = pygame.Rect(VIRTUAL_WIDTH-150, VIRTUAL_HEIGHT-80, 140, 60)
-        self.background_texture = create_background_texture(VIRTUAL_WIDTH, VIRTUAL_HEIGHT)
+        if "background" in changed:
+            self.background_texture = create_background_texture(VIRTUAL_WIDTH, VIRTUAL_HEIGHT, rng=self.rng.background)
+        self.compositor.invalidate("rebuild_ui")
+    @traced
     def create_grid_background(self):
         bg_width = GRID_WIDTH * CELL_SIZE; bg_height = GRID_HEIGHT * CELL_SIZE
         bg = pygame.Surface((bg_width, bg_height))
-        for y in range(bg_height):
-            ratio = y / bg_height
-            r = int(30 + (70-30) * ratio)
-            g = int(30 + (70-30) * ratio)
-            b = int(60 + (90-60) * ratio)
-            pygame.draw.line(bg, (r, g, b), (0, y), (bg_width, y))
+        dots = []
         for x in range(GRID_WIDTH):
             for y in range(GRID_HEIGHT):
-                cell_rect = pygame.Rect(x*CELL_SIZE, y*CELL_SIZE, CELL_SIZE, CELL_SIZE)
-                base_color = DARK_BROWN if (x+y)%2==0 else (60,50,40)
-                if any((x,y) in route for route in self.routes):
-                    base_color = PATH_COLOR
-                pygame.draw.rect(bg, base_color, cell_rect)
                 rnd = random.Random(x*100+y)
                 for _ in range(2):
-                    dot_x = cell_rect.x + rnd.randint(2, CELL_SIZE-4)
-                    dot_y = cell_rect.y + rnd.randint(2, CELL_SIZE-4)
-                    pygame.draw.circle(bg, (80,70,60), (dot_x,dot_y), 2)
-                pygame.draw.rect(bg, BLACK, cell_rect, 1)
+                    dots.append((x*CELL_SIZE + rnd.randint(2, CELL_SIZE-4), y*CELL_SIZE + rnd.randint(2, CELL_SIZE-4)))
+        if np is not None:
+            cells = np.full((GRID_WIDTH, GRID_HEIGHT), bg.map_rgb((60,50,40)), np.uint32)
+            cells[np.add.outer(np.arange(GRID_WIDTH), np.arange(GRID_HEIGHT)) % 2 == 0] = bg.map_rgb(DARK_BROWN)
+            cells[self.board.grid() == Board.PATH] = bg.map_rgb(PATH_COLOR)
+            pixels = pygame.surfarray.pixels2d(bg)
+            pixels[:] = cells.repeat(CELL_SIZE, 0).repeat(CELL_SIZE, 1)
+            offsets = np.argwhere(circle_mask(2, 5)) - 2
+            dots = np.array(dots)
+            pixels[dots[:, :1] + offsets[:, 0], dots[:, 1:] + offsets[:, 1]] = bg.map_rgb((80,70,60))
+            for edge in (0, CELL_SIZE - 1):
+                pixels[edge::CELL_SIZE] = bg.map_rgb(BLACK)
+                pixels[:, edge::CELL_SIZE] = bg.map_rgb(BLACK)
+            del pixels
+        else:
+            for x in range(GRID_WIDTH):
+                for y in range(GRID_HEIGHT):
+                    cell_rect = pygame.Rect(x*CELL_SIZE, y*CELL_SIZE, CELL_SIZE, CELL_SIZE)
+                    base_color = PATH_COLOR if self.board.is_path((x,y)) else DARK_BROWN if (x+y)%2==0 else (60,50,40)
+                    pygame.draw.rect(bg, base_color, cell_rect)
+                    for dot in dots[(x*GRID_HEIGHT+y)*2:(x*GRID_HEIGHT+y)*2+2]:
+                        pygame.draw.circle(bg, (80,70,60), dot, 2)
+                    pygame.draw.rect(bg, BLACK, cell_rect, 1)
         for route in self.routes:
             pts = []
             for coord in route:
@@ -953,7 +1996,7 @@ class GameManager:
                 center = (gx*CELL_SIZE+CELL_SIZE//2, gy*CELL_SIZE+CELL_SIZE//2)
                 pts.append(center)
             pygame.draw.lines(bg, RED, False, pts, 2)
-            castle = create_castle_sprite()
+            castle = get_castle_sprite()
             end_cell = route[-1]
             cx = end_cell[0]*CELL_SIZE + CELL_SIZE//2 - 20
             cy = end_cell[1]*CELL_SIZE + CELL_SIZE//2 - 20
@@ -998,40 +2041,105 @@ class GameManager:
     def draw_info_button(self, surface):
         pygame.draw.rect(surface, LIGHT_BLUE, self.info_button_rect, border_radius=8)
         pygame.draw.rect(surface, BLACK, self.info_button_rect, 4, border_radius=8)
-        info_text = self.font.render("INFO", True, BLACK)
+        info_text = TEXT_CACHE.render(self.font, "INFO", BLACK)
         surface.blit(info_text, info_text.get_rect(center=self.info_button_rect.center))
     def draw_start_pause_button(self, surface):
         text = "START" if self.state in ["deck", "paused"] else "PAUSE" if self.state=="playing" else ""
         draw_big_button(surface, self.start_pause_button_rect, text, self.font, GREEN, BLACK, BLACK)
-    def draw_top_panel(self, surface):
-        self.top_panel.fill(DARK_GRAY)
+    def update_top_panel(self):
         hud_text = f"Health: {self.player_health}   Gold: {int(self.gold)}   Wave: {self.wave}"
-        hud_surface = self.font.render(hud_text, True, WHITE)
-        self.top_panel.blit(hud_surface, (20,10))
+        if hud_text != self.hud_text:
+            self.top_panel.fill(DARK_GRAY)
+            TEXT_CACHE.atlas(self.font, WHITE).blit(self.top_panel, hud_text, (20,10))
+            self.hud_text = hud_text
+    def draw_top_panel(self, surface):
+        self.update_top_panel()
         surface.blit(self.top_panel, (0,0))
+    @traced
+    def paint_static_layer(self, layer):
+        layer.fill(DARK_GRAY)
+        layer.blit(self.grid_background, (GRID_OFFSET_X, GRID_OFFSET_Y))
+    @traced
+    def paint_semi_static_layer(self, layer):
+        shop_rect = pygame.Rect(0, TOP_PANEL_HEIGHT, LEFT_PANEL_WIDTH, GAME_BOARD_HEIGHT+INFO_PANEL_HEIGHT)
+        pygame.draw.rect(layer, LIGHT_GRAY, shop_rect)
+        if self.state in ["deck", "paused"]:
+            self.tower_deck.draw_cards(layer)
+        self.passive_tracker.draw(layer)
+        self.draw_info_button(layer)
+        self.draw_start_pause_button(layer)
+    def draw_entities(self, surface):
+        board = pygame.Rect(LEFT_PANEL_WIDTH, TOP_PANEL_HEIGHT, central_width, GAME_BOARD_HEIGHT)
+        surface.set_clip(board)
+        rects = []
+        for spelltower in self.towers:
+            rects.append(spelltower.draw(surface).clip(board))
+        alpha = self.render_alpha if self.state == "playing" else 1.0
+        if alpha < 1.0 and self.enemy_store is not None:
+            for demon, x, y in zip(self.enemies, *self.enemy_store.interpolated_positions(alpha)):
+                rects.append(demon.draw(surface, (x, y)).clip(board))
+        else:
+            for demon in self.enemies:
+                rects.append(demon.draw(surface, demon.render_pos(alpha)).clip(board))
+        for anim in self.attack_animations:
+            rects.append(anim.draw(surface).clip(board))
+        surface.set_clip(None)
+        return rects
+    def draw_dirty(self, surface):
+        if self.state not in ["deck", "playing", "paused"]:
+            self.draw(surface)
+            return None
+        self.compositor.sync_state(self.state)
+        base = self.compositor.base(surface.get_size())
+        full = self.dirty_prev_rects is None or self.compositor.version != self.dirty_base_version
+        self.dirty_base_version = self.compositor.version
+        dirty = list(self.dirty_prev_rects or [])
+        if full:
+            surface.blit(base, (0, 0))
+        else:
+            for rect in dirty:
+                surface.blit(base, rect, rect)
+        if PROFILER.enabled:
+            PROFILER.lap("draw_base")
+        current = self.draw_entities(surface)
+        if PROFILER.enabled:
+            PROFILER.lap("draw_entities")
+        hud_text = self.hud_text
+        if full:
+            self.draw_top_panel(surface)
+        else:
+            self.update_top_panel()
+            if self.hud_text != hud_text:
+                dirty.append(surface.blit(self.top_panel, (0,0)))
+        if self.state in ["deck", "paused"]:
+            current.extend(self.tower_deck.draw_sparkles(surface))
+        self.dirty_prev_rects = current
+        dirty.extend(current)
+        area = sum(rect.width * rect.height for rect in dirty)
+        if full or area > DIRTY_RECT_THRESHOLD * surface.get_width() * surface.get_height():
+            return None
+        return dirty
     def draw(self, surface):
-        surface.fill(DARK_GRAY)
+        self.dirty_prev_rects = None
         if self.state=="intro":
+            surface.fill(DARK_GRAY)
             self.draw_intro(surface); return
         if self.state=="info":
+            surface.fill(DARK_GRAY)
             self.draw_info_screen(surface); return
         if self.state=="passive_choice":
+            surface.fill(DARK_GRAY)
             self.draw_passive_choice_menu(surface); return
-        surface.blit(self.grid_background, (GRID_OFFSET_X, GRID_OFFSET_Y))
-        for spelltower in self.towers:
-            spelltower.draw(surface)
-        for demon in self.enemies:
-            demon.draw(surface)
-        for anim in self.attack_animations:
-            anim.draw(surface)
+        self.compositor.sync_state(self.state)
+        surface.blit(self.compositor.base(surface.get_size()), (0,0))
+        if PROFILER.enabled:
+            PROFILER.lap("draw_base")
+        self.draw_entities(surface)
+        if PROFILER.enabled:
+            PROFILER.lap("draw_entities")
         self.draw_top_panel(surface)
-        shop_rect = pygame.Rect(0, TOP_PANEL_HEIGHT, LEFT_PANEL_WIDTH, GAME_BOARD_HEIGHT+INFO_PANEL_HEIGHT)
-        pygame.draw.rect(surface, LIGHT_GRAY, shop_rect)
         if self.state in ["deck", "paused"]:
-            self.tower_deck.draw(surface, offset=(0, TOP_PANEL_HEIGHT))
-        self.passive_tracker.draw(surface)
-        self.draw_info_button(surface)
-        self.draw_start_pause_button(surface)
+            self.tower_deck.draw_sparkles(surface)
         if self.state=="upgrade_menu" and self.pending_upgrade_tower is not None:
             upgrade_rect = pygame.Rect(self.pending_upgrade_tower.pos[0]-60, self.pending_upgrade_tower.pos[1]-60, 150, 70)
             draw_big_button(surface, upgrade_rect, "Upgrade?\nCost: 30 Gold", self.font, LIGHT_BLUE, BLACK, BLACK)
@@ -1054,7 +2162,11 @@ class GameManager:
                 if res=="resume":
                     self.state = self.previous_state
                 elif res=="reset":
+                    recorder = self.recorder
                     self.__init__()
+                    if recorder is not None:
+                        recorder.restart(self.rng.seed)
+                        self.recorder = recorder
                     self.state = "intro"
             return
         if self.state=="upgrade_menu":
@@ -1071,9 +2183,7 @@ class GameManager:
                 pos = event.pos
                 for button_rect, passive in self.passive_choice_buttons:
                     if button_rect.collidepoint(pos):
-                        self.passive_tracker.passives[passive["id"]]["stack"] += 1
-                        self.state = "deck"
-                        self.passive_choices = []
+                        self.choose_passive(passive)
                         return
             return
         if event.type == pygame.MOUSEBUTTONDOWN:
@@ -1099,20 +2209,16 @@ class GameManager:
                         if self.current_tower_selection:
                             grid_x = (pos[0]-GRID_OFFSET_X)//CELL_SIZE
                             grid_y = (pos[1]-GRID_OFFSET_Y)//CELL_SIZE
-                            if not any((grid_x,grid_y) in route for route in self.routes) and not any(tower.grid_pos==(grid_x,grid_y) for tower in self.towers):
-                                new_tower = Tower((grid_x,grid_y), self.current_tower_selection)
-                                self.towers.append(new_tower)
-                                self.current_tower_selection = None
+                            self.place_tower((grid_x,grid_y))
                 elif event.button == 3:
                     if (GRID_OFFSET_X <= pos[0] < GRID_OFFSET_X+GRID_WIDTH*CELL_SIZE and
                         GRID_OFFSET_Y <= pos[1] < GRID_OFFSET_Y+GRID_HEIGHT*CELL_SIZE):
                         grid_x = (pos[0]-GRID_OFFSET_X)//CELL_SIZE
                         grid_y = (pos[1]-GRID_OFFSET_Y)//CELL_SIZE
-                        for tower in self.towers:
-                            if tower.grid_pos==(grid_x,grid_y):
-                                self.pending_upgrade_tower = tower
-                                self.state = "upgrade_menu"
-                                break
+                        tower = self.tower_at((grid_x,grid_y))
+                        if tower is not None:
+                            self.pending_upgrade_tower = tower
+                            self.state = "upgrade_menu"
             return
         if event.type == pygame.KEYDOWN:
             if event.key == pygame.K_SPACE:
@@ -1138,31 +2244,593 @@ def update_attack_sprites(attack_sprites, color, thickness):
         new_sprites.append(new_sprite)
     return new_sprites
 
-def main():
-    global VIRTUAL_WIDTH, VIRTUAL_HEIGHT
+class FixedStepLoop:
+    def __init__(self, step_dt=SIM_DT, max_steps=MAX_STEPS_PER_FRAME):
+        self.step_dt = step_dt
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        self.alpha = 1.0
+        self.steps = 0
+        self.dropped_steps = 0
+    def advance(self, frame_dt, step):
+        self.accumulator += frame_dt
+        steps = 0
+        while self.accumulator >= self.step_dt:
+            if steps >= self.max_steps:
+                dropped = int(self.accumulator / self.step_dt)
+                self.dropped_steps += dropped
+                self.accumulator -= dropped * self.step_dt
+                break
+            step(self.step_dt)
+            self.accumulator -= self.step_dt
+            steps += 1
+        self.steps += steps
+        self.alpha = self.accumulator / self.step_dt
+        return steps
+
+class PerfOverlay:
+    PHASES = ("idle", "events", "spawn", "demons", "towers", "animations", "draw_base", "draw_entities", "draw_ui", "overlay", "scale", "flip")
+    def __init__(self, width=250, graph_height=50):
+        self.font = FONTS.get(14, MONO_FONTS)
+        self.text = TEXT_CACHE.atlas(self.font, WHITE)
+        self.line = self.font.get_linesize()
+        self.surface = pygame.Surface((width, self.line * (len(self.PHASES) + 3) + graph_height + 12))
+        self.graph_height = graph_height
+    def draw(self, surface, profiler, gm):
+        panel = self.surface
+        panel.fill((15,15,20))
+        times = profiler.frame_times
+        frame = times[-1] if times else 0.0
+        worst = max(times) if times else 0.0
+        fps = 1000.0 / frame if frame else 0.0
+        self.text.blit(panel, f"{fps:5.1f} fps {frame:6.2f} ms max {worst:6.2f}", (6, 4))
+        y = 4 + self.line
+        for name in self.PHASES:
+            self.text.blit(panel, f"{name:<14}{profiler.frame.get(name, 0.0):7.3f} ms", (6, y))
+            y += self.line
+        self.text.blit(panel, f"demons {len(gm.enemies)} anims {len(gm.attack_animations)} towers {len(gm.towers)}", (6, y))
+        y += self.line + 4
+        graph = pygame.Rect(6, y, panel.get_width() - 12, self.graph_height)
+        pygame.draw.rect(panel, (40,40,50), graph)
+        scale = graph.height / max(worst, 1000.0 / FPS * 2)
+        budget = graph.bottom - int(1000.0 / FPS * scale)
+        pygame.draw.line(panel, (90,90,110), (graph.left, budget), (graph.right - 1, budget))
+        for i, ms in enumerate(times):
+            x = graph.right - len(times) + i
+            if x >= graph.left:
+                color = GREEN if ms <= 1000.0 / FPS * 1.1 else RED
+                pygame.draw.line(panel, color, (x, graph.bottom - 1), (x, graph.bottom - 1 - int(ms * scale)))
+        return surface.blit(panel, (surface.get_width() - panel.get_width() - 4, 4))
+
+class Presenter:
+    def __init__(self, mode=PRESENT_MODE):
+        self.mode = mode
+        self.key = None
+        self.rect = None
+        self.target = None
+        self.bars = []
+        self.fresh = False
+    def layout(self, window, size):
+        key = (window.get_size(), size)
+        if key == self.key:
+            return self.rect
+        self.key = key
+        self.fresh = True
+        (ww, wh), (vw, vh) = key
+        k = min(ww // vw, wh // vh)
+        if (ww, wh) == (vw, vh) or self.mode != "integer":
+            self.rect = window.get_rect()
+        elif k >= 1:
+            self.rect = pygame.Rect((ww - vw * k) // 2, (wh - vh * k) // 2, vw * k, vh * k)
+        else:
+            fit = min(ww / vw, wh / vh)
+            self.rect = pygame.Rect(0, 0, max(1, int(vw * fit)), max(1, int(vh * fit)))
+            self.rect.center = (ww // 2, wh // 2)
+        self.target = window if self.rect.size == (ww, wh) else window.subsurface(self.rect)
+        r = self.rect
+        self.bars = [bar for bar in (pygame.Rect(0, 0, ww, r.top), pygame.Rect(0, r.bottom, ww, wh - r.bottom),
+                                     pygame.Rect(0, r.top, r.left, r.height), pygame.Rect(r.right, r.top, ww - r.right, r.height)) if bar.width and bar.height]
+        return self.rect
+    def present(self, window, surface, rects=None):
+        rect = self.layout(window, surface.get_size())
+        if self.fresh:
+            self.fresh = False
+            for bar in self.bars:
+                window.fill(BLACK, bar)
+            rects = None
+        if rect.size != surface.get_size():
+            pygame.transform.scale(surface, rect.size, self.target)
+            return None
+        if rects is None:
+            window.blit(surface, rect.topleft)
+            return None
+        moved = [r.move(rect.topleft) for r in rects]
+        for src, dst in zip(rects, moved):
+            window.blit(surface, dst, src)
+        return moved
+    def to_virtual(self, pos):
+        if self.rect is None:
+            return pos
+        (vw, vh), r = self.key[1], self.rect
+        x, y = (pos[0] - r.x) * vw // r.width, (pos[1] - r.y) * vh // r.height
+        return (x, y) if 0 <= x < vw and 0 <= y < vh else None
+    def map_event(self, event):
+        if event.type not in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION) or self.rect is None:
+            return event
+        pos = self.to_virtual(event.pos)
+        if pos is None:
+            return None
+        return pygame.event.Event(event.type, dict(event.dict, pos=pos))
+
+def cell_coverage(sim, cell, radius):
+    cx = GRID_OFFSET_X + cell[0] * CELL_SIZE + CELL_SIZE//2
+    cy = GRID_OFFSET_Y + cell[1] * CELL_SIZE + CELL_SIZE//2
+    return sum(1 for route in sim.route_paths for px, py in route.points if math.hypot(px-cx, py-cy) <= radius)
+
+def greedy_strategy(sim):
+    while sim.tower_deck.buttons and sim.gold >= 25:
+        sim.buy_tower(0)
+        spec = sim.current_tower_selection
+        free = sim.board.free_cells()
+        if not free:
+            sim.current_tower_selection = None
+            break
+        sim.place_tower(max(free, key=lambda cell: cell_coverage(sim, cell, spec["range"])))
+    for tower in sorted(sim.towers, key=lambda t: t.upgrade_level):
+        if tower.upgrade_level < 3:
+            sim.upgrade_tower(tower)
+
+def random_strategy(sim):
+    while sim.tower_deck.buttons and sim.gold >= 25:
+        sim.buy_tower(sim.rng.strategy.randrange(len(sim.tower_deck.buttons)))
+        free = sim.board.free_cells()
+        if not free:
+            sim.current_tower_selection = None
+            break
+        sim.place_tower(sim.rng.strategy.choice(free))
+
+def upgrade_first_strategy(sim):
+    for tower in sorted(sim.towers, key=lambda t: -t.damage):
+        while tower.upgrade_level < 3:
+            level = tower.upgrade_level
+            sim.upgrade_tower(tower)
+            if tower.upgrade_level == level:
+                return
+    greedy_strategy(sim)
+
+STRATEGIES = {"greedy": greedy_strategy, "random": random_strategy, "upgrade": upgrade_first_strategy}
+
+def balance_tables(config):
+    towers = config.get("towers", {})
+    demons = config.get("demons", {})
+    tower_pool = [dict(spec, **towers.get(spec["name"], {})) for spec in TOWER_POOL]
+    spawn_table = [dict(spec, **demons.get(spec["type"], {})) for spec in DEMON_SPAWN_TABLE]
+    return tower_pool, spawn_table
+
+def play_headless(waves, seed=None, strategy=greedy_strategy, dt=SIM_DT, recorder=None, config=None):
+    tower_pool, spawn_table = balance_tables(config) if config else (None, None)
+    sim = Simulation(seed=seed, tower_pool=tower_pool, spawn_table=spawn_table)
+    if recorder is not None:
+        recorder.restart(sim.rng.seed)
+        sim.recorder = recorder
+    gold_curve = []
+    while sim.wave < waves and sim.state != "gameover":
+        strategy(sim)
+        sim.start_wave()
+        while sim.state == "playing":
+            sim.update(dt)
+        gold_curve.append(int(sim.gold))
+        if sim.state == "passive_choice":
+            sim.choose_passive(sim.passive_choices[0])
+    result = sim.summary()
+    result["seed"] = sim.rng.seed
+    result["gold_curve"] = gold_curve
+    result["leaks"] = dict(sim.leaks)
+    return result
+
+def run_headless(args):
+    start = time.perf_counter()
+    results = []
+    recorder = Replay(args.seed) if args.record else None
+    for i in range(args.runs):
+        seed = None if args.seed is None else args.seed + i
+        result = play_headless(args.waves, seed=seed, recorder=recorder)
+        results.append(result)
+        print(f"run {i+1}/{args.runs} seed={result['seed']} waves_survived={result['waves_survived']} "
+              f"health={result['health']} gold={result['gold']} towers={result['towers']}")
+    elapsed = time.perf_counter() - start
+    mean = sum(r["waves_survived"] for r in results) / len(results)
+    print(f"{len(results)} runs in {elapsed:.2f}s, mean waves survived {mean:.2f}")
+    if recorder is not None:
+        recorder.save(args.record)
+    return results
+
+def balance_worker_init():
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def balance_job(job):
+    config, strategy, seed, waves = job
+    return config["name"], strategy, play_headless(waves, seed=seed, strategy=STRATEGIES[strategy], config=config)
+
+def aggregate_balance(results):
+    survived = sorted(r["waves_survived"] for r in results)
+    curves = [r["gold_curve"] for r in results]
+    gold_curve = []
+    for wave in range(max(len(curve) for curve in curves)):
+        golds = [curve[wave] for curve in curves if len(curve) > wave]
+        gold_curve.append(round(sum(golds) / len(golds), 1))
+    leaks = Counter()
+    for r in results:
+        leaks.update(r["leaks"])
+    return {"games": len(results), "mean_waves_survived": round(sum(survived) / len(survived), 3),
+            "p10_waves_survived": survived[len(survived) // 10], "median_waves_survived": survived[len(survived) // 2],
+            "gameover_rate": round(sum(1 for r in results if r["health"] <= 0) / len(results), 3),
+            "mean_gold_curve": gold_curve,
+            "leaks_per_game": {name: round(count / len(results), 3) for name, count in leaks.most_common()}}
+
+def run_balance(args):
+    import multiprocessing
+    if args.balance:
+        with open(args.balance) as f:
+            configs = json.load(f)
+    else:
+        configs = [{"name": "baseline"}]
+    strategies = args.strategies.split(",")
+    for strategy in strategies:
+        if strategy not in STRATEGIES:
+            raise SystemExit(f"unknown strategy {strategy!r}, choose from {', '.join(STRATEGIES)}")
+    seed = args.seed if args.seed is not None else 0
+    jobs = [(config, strategy, seed + i, args.waves) for config in configs for strategy in strategies for i in range(args.runs)]
+    workers = args.workers or multiprocessing.cpu_count()
+    grouped = {(config["name"], strategy): [] for config in configs for strategy in strategies}
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=balance_worker_init) as pool:
+        for name, strategy, result in pool.imap_unordered(balance_job, jobs, chunksize=max(1, len(jobs) // (workers * 16))):
+            grouped[(name, strategy)].append(result)
+    elapsed = time.perf_counter() - start
+    report = []
+    for (name, strategy), results in grouped.items():
+        row = dict(config=name, strategy=strategy, **aggregate_balance(results))
+        report.append(row)
+        top_leaks = ", ".join(f"{k} {v}" for k, v in list(row["leaks_per_game"].items())[:3])
+        print(f"{name:<20} {strategy:<8} games={row['games']} waves={row['mean_waves_survived']:.2f} "
+              f"median={row['median_waves_survived']} p10={row['p10_waves_survived']} gameover={row['gameover_rate']:.1%} "
+              f"leaks/game: {top_leaks or 'none'}")
+    print(f"{len(jobs)} games on {workers} workers in {elapsed:.1f}s ({len(jobs) / elapsed:.1f} games/s)")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+def play_replay(replay, dt=SIM_DT):
+    set_virtual_size(*replay.layout[:2])
+    sim = Simulation(seed=replay.seed)
+    player = ReplayPlayer(sim, replay)
+    while sim.state != "gameover":
+        player.apply_due()
+        if sim.state == "playing":
+            sim.update(dt)
+        elif player.done:
+            break
+        elif player.actions[player.index][0] > sim.tick:
+            raise ValueError(f"replay stalled at tick {sim.tick} in state {sim.state!r}")
+    return sim
+
+def run_replay(args):
+    replay = Replay.load(args.replay)
+    start = time.perf_counter()
+    sim = play_replay(replay)
+    elapsed = time.perf_counter() - start
+    result = sim.summary()
+    print(f"replay seed={replay.seed} actions={len(replay.actions)} ticks={sim.tick} waves_survived={result['waves_survived']} "
+          f"health={result['health']} gold={result['gold']} towers={result['towers']} in {elapsed:.2f}s")
+    return result
+
+BENCH_SCENARIOS = {
+    "light": {"towers": 0, "demons": 2, "animations": 16},
+    "typical": {"towers": 1, "demons": 10, "animations": 128},
+    "heavy": {"towers": 2, "demons": 50, "animations": 512},
+}
+BENCH_REGRESSION = 1.15
+
+def build_bench_scene(towers, demons, animations, seed=0):
+    gm = GameManager(seed=seed)
+    gm.state = "playing"
+    gm.gold = gm.player_health = 10**9
+    free = gm.board.free_cells()
+    for spec in TOWER_POOL:
+        for level in range(4):
+            for _ in range(towers):
+                tower = Tower(free[len(gm.towers) % len(free)], spec)
+                while tower.upgrade_level < level:
+                    gm.upgrade_tower(tower)
+                gm.add_tower(tower)
+    rng = random.Random(seed)
+    for spec in gm.spawn_table:
+        for _ in range(demons):
+            route = rng.choice(gm.route_paths)
+            demon = gm.spawn_demon(spec, route, 50 * spec["speed"], 10**9)
+            demon.distance = demon.prev_distance = rng.uniform(0, route.length * 0.6)
+            demon.pos = route.point_at(demon.distance)
+    gm.enemies = gm.enemy_store.views if gm.enemy_store is not None else gm.enemies
+    gm.attack_animations.clear()
+    elements = sorted({spec["design"] for spec in TOWER_POOL})
+    board = pygame.Rect(GRID_OFFSET_X, GRID_OFFSET_Y, GRID_WIDTH*CELL_SIZE, GRID_HEIGHT*CELL_SIZE)
+    for i in range(animations):
+        start = (rng.randrange(board.left, board.right), rng.randrange(board.top, board.bottom))
+        end = (rng.randrange(board.left, board.right), rng.randrange(board.top, board.bottom))
+        gm.attack_animations.spawn(start, end, 3600.0, GOLD, element=elements[i % len(elements)])
+    return gm
+
+def time_calls(call, ticks):
+    samples = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    samples.sort()
+    pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))], 4)
+    return {"mean": round(sum(samples) / len(samples), 4), "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": round(samples[-1], 4)}
+
+def trace_allocations(call, ticks):
+    peak = blocks = 0
+    tracemalloc.start()
+    for _ in range(ticks):
+        before_blocks = sys.getallocatedblocks()
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        call()
+        peak += tracemalloc.get_traced_memory()[1] - before
+        blocks += sys.getallocatedblocks() - before_blocks
+    tracemalloc.stop()
+    return {"peak_kb": round(peak / ticks / 1024, 2), "net_blocks": round(blocks / ticks, 2)}
+
+def bench_scenario(params, ticks, warmup=20):
+    gm = build_bench_scene(**params)
+    surface = pygame.Surface((VIRTUAL_WIDTH, VIRTUAL_HEIGHT))
+    update = lambda: gm.update(SIM_DT)
+    draw = lambda: gm.draw(surface)
+    for _ in range(warmup):
+        update(); draw()
+    result = {"params": params, "entities": {"towers": len(gm.towers), "demons": len(gm.enemies), "animations": len(gm.attack_animations)}}
+    result["update_ms"] = time_calls(update, ticks)
+    result["draw_ms"] = time_calls(draw, ticks)
+    result["update_alloc"] = trace_allocations(update, max(1, ticks // 4))
+    result["draw_alloc"] = trace_allocations(draw, max(1, ticks // 4))
+    return result
+
+def compare_bench(report, baseline):
+    regressions = []
+    for name, result in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old is None or old["params"] != result["params"]:
+            continue
+        for phase in ("update_ms", "draw_ms"):
+            ratio = result[phase]["p50"] / max(old[phase]["p50"], 1e-6)
+            if ratio > BENCH_REGRESSION:
+                regressions.append(f"{name} {phase} p50 {old[phase]['p50']:.3f} -> {result[phase]['p50']:.3f} ms ({ratio:.2f}x)")
+    return regressions
+
+def run_bench(args):
+    names = args.scenarios.split(",") if args.scenarios else list(BENCH_SCENARIOS)
+    report = {"meta": {"python": platform.python_version(), "pygame": pygame.version.ver, "numpy": np.__version__ if np is not None else None,
+                       "machine": platform.machine(), "ticks": args.ticks, "size": [VIRTUAL_WIDTH, VIRTUAL_HEIGHT]}, "scenarios": {}}
+    for name in names:
+        if name not in BENCH_SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r}, choose from {', '.join(BENCH_SCENARIOS)}")
+        result = bench_scenario(BENCH_SCENARIOS[name], args.ticks)
+        report["scenarios"][name] = result
+        update, draw = result["update_ms"], result["draw_ms"]
+        print(f"{name:<8} {result['entities']['towers']:>3} towers {result['entities']['demons']:>4} demons {result['entities']['animations']:>3} anims | "
+              f"update p50 {update['p50']:.3f} p99 {update['p99']:.3f} ms, {result['update_alloc']['peak_kb']:.1f} KB/tick | "
+              f"draw p50 {draw['p50']:.3f} p99 {draw['p99']:.3f} ms, {result['draw_alloc']['peak_kb']:.1f} KB/tick")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_bench(report, json.load(f))
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            raise SystemExit(1)
+    return report
+
+PRESENT_SIZES = {"720p": (1280, 720), "1080p": (1920, 1080), "1440p": (2560, 1440)}
+
+def legacy_present(window, surface):
+    window.blit(pygame.transform.scale(surface, window.get_size()), (0, 0))
+
+def run_present_bench(args):
+    frame = pygame.Surface((VIRTUAL_WIDTH, VIRTUAL_HEIGHT))
+    build_bench_scene(**BENCH_SCENARIOS["typical"]).draw(frame)
+    report = {"meta": {"pygame": pygame.version.ver, "ticks": args.ticks, "virtual": [VIRTUAL_WIDTH, VIRTUAL_HEIGHT]}, "sizes": {}}
+    for name, size in PRESENT_SIZES.items():
+        window = pygame.Surface(size)
+        native = pygame.transform.scale(frame, size)
+        results = {"legacy": time_calls(lambda: legacy_present(window, frame), args.ticks)}
+        for mode in PRESENT_MODES:
+            presenter = Presenter(mode)
+            surface = native if mode == "native" else frame
+            results[mode] = time_calls(lambda: presenter.present(window, surface), args.ticks)
+            results[mode]["rect"] = list(presenter.rect)
+        report["sizes"][name] = results
+        print(f"{name:<6} " + " | ".join(f"{mode} p50 {result['p50']:.3f} p99 {result['p99']:.3f} ms" for mode, result in results.items()))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+STARTUP_PROBE = ("import sys, time; sys.path.insert(0, {path!r}); start = time.perf_counter(); import {module}; imported = time.perf_counter(); "
+                 "{module}.Simulation(seed=0); ready = time.perf_counter(); "
+                 "print(imported - start, ready - start, {module}.pygame.display.get_init(), {module}.pygame.font.get_init())")
+
+def run_startup_bench(args):
+    script = os.path.abspath(__file__)
+    probe = STARTUP_PROBE.format(path=os.path.dirname(script), module=os.path.splitext(os.path.basename(script))[0])
+    samples = {"import_ms": [], "headless_ready_ms": [], "launch_to_first_frame_ms": []}
+    headless_init = set()
+    for _ in range(max(args.runs, 5)):
+        fields = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True).stdout.splitlines()[-1].split()
+        samples["import_ms"].append(float(fields[0]) * 1000.0)
+        samples["headless_ready_ms"].append(float(fields[1]) * 1000.0)
+        headless_init.add((fields[2], fields[3]))
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script, "--frames", "1"], capture_output=True, check=True)
+        samples["launch_to_first_frame_ms"].append((time.perf_counter() - start) * 1000.0)
+    report = {"runs": len(samples["import_ms"]), "headless_display_init": any(display == "True" for display, _ in headless_init),
+              "headless_font_init": any(font == "True" for _, font in headless_init)}
+    for name, values in samples.items():
+        values.sort()
+        report[name] = {"min": round(values[0], 2), "median": round(values[len(values) // 2], 2), "max": round(values[-1], 2)}
+        print(f"{name:<26} median {report[name]['median']:8.1f} ms  min {report[name]['min']:8.1f} ms  max {report[name]['max']:8.1f} ms")
+    print(f"headless run initialised display: {report['headless_display_init']}, fonts: {report['headless_font_init']}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Spelltower Clash")
+    parser.add_argument("--headless", action="store_true", help="simulate games without a window or rendering")
+    parser.add_argument("--waves", type=int, default=10, help="waves to play per headless run")
+    parser.add_argument("--runs", type=int, default=1, help="number of headless runs")
+    parser.add_argument("--seed", type=int, default=None, help="run seed (first run's seed when headless)")
+    parser.add_argument("--record", metavar="PATH", default=None, help="record the player's actions to a replay file")
+    parser.add_argument("--replay", metavar="PATH", default=None, help="play back a replay file (at full speed with --headless)")
+    parser.add_argument("--balance", metavar="CONFIGS", nargs="?", const="", default=None,
+                        help="run a headless balancing sweep; CONFIGS is a JSON list of {name, towers: {tower name: stats}, demons: {demon type: spawn stats}}")
+    parser.add_argument("--strategies", default="greedy", help=f"comma separated placement strategies for --balance ({', '.join(STRATEGIES)})")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes for --balance (default: all cores)")
+    parser.add_argument("--trace", metavar="PATH", default=None, help="write a Chrome/Perfetto trace-event JSON of frame phases and slow calls")
+    parser.add_argument("--bench", action="store_true", help="time update and draw on synthetic scenes")
+    parser.add_argument("--scenarios", default=None, help=f"comma separated --bench scenarios ({', '.join(BENCH_SCENARIOS)})")
+    parser.add_argument("--ticks", type=int, default=300, help="measured ticks per --bench scenario")
+    parser.add_argument("--startup-bench", action="store_true", help="measure import, headless start-up and launch-to-first-frame times in fresh processes")
+    parser.add_argument("--present", choices=PRESENT_MODES, default=PRESENT_MODE,
+                        help="native: the board follows the window size; scale: stretch the board to the window; integer: letterboxed whole-number scaling")
+    parser.add_argument("--present-bench", action="store_true", help="time presenting a frame to 720p, 1080p and 1440p windows in each --present mode")
+    parser.add_argument("--frames", type=int, default=0, help="quit the game after this many frames")
+    parser.add_argument("--baseline", metavar="PATH", default=None, help="compare --bench against a saved JSON baseline and fail on regressions")
+    parser.add_argument("--out", metavar="PATH", default=None, help="write the --balance, --bench, --present-bench or --startup-bench report as JSON")
+    args = parser.parse_args(argv)
+    if args.record and args.headless and args.runs != 1:
+        parser.error("--record needs --runs 1 when headless")
+    if args.record and args.replay:
+        parser.error("--record and --replay are mutually exclusive")
+    if args.trace and args.balance is not None:
+        parser.error("--trace records a single process and cannot be used with --balance")
+    return args
+
+def main(args=None):
+    replay = Replay.load(args.replay) if args and args.replay else None
+    if replay is not None:
+        set_virtual_size(*replay.layout[:2])
     window = pygame.display.set_mode((VIRTUAL_WIDTH, VIRTUAL_HEIGHT), pygame.RESIZABLE)
     pygame.display.set_caption("Spelltower Clash")
-    gm = GameManager()
+    if replay is not None:
+        gm = GameManager(seed=replay.seed)
+        gm.state = "deck"
+        step = ReplayPlayer(gm, replay).step
+    else:
+        gm = GameManager(seed=args.seed if args else None)
+        step = gm.update
+        if args and args.record:
+            gm.recorder = Replay(gm.rng.seed)
     virtual_surface = pygame.Surface((VIRTUAL_WIDTH, VIRTUAL_HEIGHT))
+    dirty_rects = DIRTY_RECTS
+    presenter = Presenter(args.present if args else PRESENT_MODE)
+    pending_resize = None
+    loop = FixedStepLoop()
+    overlay = None
+    show_overlay = False
+    frame = 0
     running = True
     while running:
-        dt = gm.clock.tick(FPS) / 1000.0
+        if args and args.frames and frame >= args.frames:
+            break
+        frame += 1
+        if PROFILER.enabled:
+            PROFILER.begin_frame()
+        frame_dt = gm.clock.tick(FPS) / 1000.0
+        if PROFILER.enabled:
+            PROFILER.lap("idle")
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.VIDEORESIZE:
-                VIRTUAL_WIDTH, VIRTUAL_HEIGHT = event.size
-                window = pygame.display.set_mode((VIRTUAL_WIDTH, VIRTUAL_HEIGHT), pygame.RESIZABLE)
+                window = pygame.display.get_surface()
+                if window.get_size() != event.size:
+                    window = pygame.display.set_mode(event.size, pygame.RESIZABLE)
+                if replay is None and presenter.mode == "native":
+                    pending_resize = (event.size, time.perf_counter() + RESIZE_DEBOUNCE)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F2:
+                dirty_rects = not dirty_rects
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                show_overlay = not show_overlay
+                overlay = overlay or PerfOverlay()
+                PROFILER.enable(show_overlay or PROFILER.tracer is not None)
+                gm.dirty_prev_rects = None
+            if replay is None:
+                event = presenter.map_event(event)
+                if event is not None:
+                    gm.handle_event(event)
+        if pending_resize is not None and time.perf_counter() >= pending_resize[1]:
+            if pending_resize[0] != (VIRTUAL_WIDTH, VIRTUAL_HEIGHT):
+                set_virtual_size(*pending_resize[0])
                 gm.rebuild_ui()
-                virtual_surface = pygame.Surface((VIRTUAL_WIDTH, VIRTUAL_HEIGHT))
-            gm.handle_event(event)
-        gm.update(dt)
-        gm.draw(virtual_surface)
-        scaled = pygame.transform.scale(virtual_surface, window.get_size())
-        window.blit(scaled, (0,0))
-        pygame.display.flip()
+            pending_resize = None
+        if PROFILER.enabled:
+            PROFILER.lap("events")
+        loop.advance(frame_dt, step)
+        if virtual_surface.get_size() != (VIRTUAL_WIDTH, VIRTUAL_HEIGHT):
+            virtual_surface = pygame.Surface((VIRTUAL_WIDTH, VIRTUAL_HEIGHT))
+        gm.render_alpha = loop.alpha
+        size = virtual_surface.get_size()
+        if dirty_rects and presenter.layout(window, size).size == size:
+            rects = gm.draw_dirty(virtual_surface)
+        else:
+            gm.draw(virtual_surface)
+            rects = None
+        if PROFILER.enabled:
+            PROFILER.lap("draw_ui")
+        if show_overlay:
+            overlay_rect = overlay.draw(virtual_surface, PROFILER, gm)
+            if rects is not None:
+                rects.append(overlay_rect)
+            PROFILER.lap("overlay")
+        rects = presenter.present(window, virtual_surface, rects)
+        if PROFILER.enabled:
+            PROFILER.lap("scale")
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+        if PROFILER.enabled:
+            PROFILER.lap("flip")
+    if gm.recorder is not None:
+        gm.recorder.save(args.record)
     pygame.quit()
     sys.exit()
 
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    if args.trace:
+        PROFILER.start_trace(args.trace)
+    try:
+        if args.startup_bench:
+            run_startup_bench(args)
+        elif args.bench:
+            run_bench(args)
+        elif args.present_bench:
+            run_present_bench(args)
+        elif args.balance is not None:
+            run_balance(args)
+        elif args.headless and args.replay:
+            run_replay(args)
+        elif args.headless:
+            run_headless(args)
+        else:
+            main(args)
+    finally:
+        PROFILER.stop_trace()